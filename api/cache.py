@@ -0,0 +1,141 @@
+import time
+from functools import wraps
+from hashlib import sha256
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+from .singleflight import single_flight
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def _version_key(name):
+    return f'catalog-version:{name}'
+
+
+def _modified_key(name):
+    return f'catalog-modified:{name}'
+
+
+def get_versions(*names):
+    """
+    Текущие значения версий и время их последнего изменения.
+    Отсутствующая версия, например после вытеснения из кеша, заводится
+    заново с новым уникальным значением, поэтому версии никогда
+    не повторяются и старые ответы не оживают.
+    Возвращает пару (список версий, время изменения в секундах).
+    """
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    modified_keys = [_modified_key(name) for name in names]
+    values = cache.get_many(keys + modified_keys)
+    for name, key, modified_key in zip(names, keys, modified_keys):
+        if key not in values or modified_key not in values:
+            _seed_version(cache, name)
+            values[key] = cache.get(key)
+            values[modified_key] = cache.get(modified_key)
+    return [values[key] for key in keys], max(values[key] for key in modified_keys)
+
+
+def _new_version():
+    return uuid4().hex
+
+
+def _seed_version(cache, name):
+    cache.add(_version_key(name), _new_version(), timeout=None)
+    cache.add(_modified_key(name), int(time.time()), timeout=None)
+
+
+def bump_versions(*names):
+    """
+    Смена версий на новые уникальные значения. Все закешированные ответы,
+    ключи которых построены на старых версиях, перестают использоваться.
+    Значение записывается, а не увеличивается через incr: в DatabaseCache
+    incr - это чтение и запись, и одновременные сбросы слились бы в одну версию.
+    """
+    now = int(time.time())
+    get_cache().set_many({
+        key: value for name in names
+        for key, value in ((_version_key(name), _new_version()), (_modified_key(name), now))
+    }, timeout=None)
+
+
+def bump_catalog_versions(shop_ids=(), categories=False, shops=False, snapshot=False):
+    """
+    Сброс кеша каталога после изменения товаров, категорий или магазинов.
+    snapshot=True, если изменились строки каталога: снимок каталога
+    становится недействительным до пересборки.
+    """
+    names = ['catalog', *(f'shop:{shop_id}' for shop_id in shop_ids)]
+    if categories:
+        names.append('categories')
+    if shops:
+        names.append('shops')
+    if snapshot:
+        names.append('snapshot')
+    bump_versions(*names)
+
+
+def get_response_key(request, view, versions):
+    """
+    Ключ ответа и время последнего изменения его данных. Ключ строится по
+    представлению, действию, параметрам адреса, отсортированным параметрам
+    запроса и значениям версий.
+    """
+    query = sorted((key, sorted(request.query_params.getlist(key))) for key in request.query_params)
+    values, modified = get_versions(*versions)
+    parts = [view.basename, view.action, sorted(view.kwargs.items()), query, list(zip(versions, values))]
+    return sha256(repr(parts).encode()).hexdigest(), modified
+
+
+def cache_response(versions):
+    """
+    Кеширование успешных ответов действия представления. versions - список
+    имен счетчиков версий или функция (представление, запрос) -> список имен.
+    Кешируются данные ответа, а не результат рендеринга, поэтому один
+    ключ обслуживает любой формат ответа.
+    При промахе ответ вычисляется через single_flight: одновременные
+    одинаковые запросы ждут одного вычисления, а не нагружают базу.
+    ETag и Last-Modified вычисляются по версиям без выполнения запросов
+    и сериализации, поэтому условный запрос с неизменившимися данными
+    сразу получает 304.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            names = versions(self, request) if callable(versions) else versions
+            key, modified = get_response_key(request, self, names)
+            etag = '"%s"' % sha256(f'{key}:{request.accepted_media_type}'.encode()).hexdigest()
+            not_modified = get_conditional_response(request, etag=etag, last_modified=modified)
+            if not_modified is None:
+                cache = get_cache()
+                data = cache.get('response:' + key)
+                if data is None:
+                    def compute():
+                        response = method(self, request, *args, **kwargs)
+                        if response.status_code == status.HTTP_200_OK:
+                            cache.set('response:' + key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+                        return response.status_code, response.data
+
+                    def load():
+                        cached = cache.get('response:' + key)
+                        return None if cached is None else (status.HTTP_200_OK, cached)
+
+                    code, data = single_flight('response:' + key, compute, load, cache)
+                    if code != status.HTTP_200_OK:
+                        return Response(data, status=code)
+                response = Response(data)
+            else:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(modified)
+            patch_vary_headers(response, ('Accept',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,267 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import BigIntegerField, CharField, Count, F, FloatField, Func, Max, Min, Q, Value
+from django.db.models.functions import Cast
+from .lookups import TrigramWordSimilarity
+from .models import Shop, Category, ProductInfo, ProductParameter, CatalogEntry, ParameterFacet
+
+
+def refresh_catalog_entries(product_info_ids):
+    """
+    Пересборка строк каталога для чтения по списку ИД ProductInfo.
+    Выполняется постоянным числом запросов на пакет.
+    """
+    product_info_ids = list(product_info_ids)
+    if not product_info_ids:
+        return
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__in=product_info_ids
+    ).order_by('id').values_list('product_info_id', 'parameter__name', 'value'):
+        parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    entries = [
+        CatalogEntry(
+            product_info_id=product_info.id,
+            shop_id=product_info.shop_id,
+            shop_name=product_info.shop.name,
+            shop_state=product_info.shop.state,
+            category_id=product_info.product.category_id,
+            category_name=product_info.product.category.name,
+            product_name=product_info.product.name,
+            model=product_info.model,
+            quantity=product_info.available,
+            price=product_info.price,
+            price_rrc=product_info.price_rrc,
+            is_active=product_info.is_active,
+            parameters=parameters.get(product_info.id, []),
+            search_text=' '.join([
+                product_info.product.name,
+                product_info.model,
+                *(parameter['value'] for parameter in parameters.get(product_info.id, []))
+            ]),
+        ) for product_info in ProductInfo.objects.filter(
+            id__in=product_info_ids
+        ).select_related('shop', 'product__category')
+    ]
+    CatalogEntry.objects.filter(product_info_id__in=product_info_ids).delete()
+    CatalogEntry.objects.bulk_create(entries)
+    if connection.vendor == 'postgresql':
+        config = settings.CATALOG_SEARCH_CONFIG
+        CatalogEntry.objects.filter(product_info_id__in=product_info_ids).update(
+            search_vector=SearchVector('product_name', 'model', weight='A', config=config) +
+            SearchVector('search_text', weight='B', config=config)
+        )
+
+
+def refresh_shop_entries(shop_ids):
+    """
+    Обновление названия и статуса магазинов в строках каталога
+    """
+    for shop_id, name, state in Shop.objects.filter(id__in=shop_ids).values_list('id', 'name', 'state'):
+        CatalogEntry.objects.filter(shop_id=shop_id).update(shop_name=name, shop_state=state)
+    refresh_facets(shop_ids)
+    refresh_stats(shop_ids)
+
+
+def refresh_category_entries(category_ids):
+    """
+    Обновление названий категорий в строках каталога
+    """
+    for category_id, name in Category.objects.filter(id__in=category_ids).values_list('id', 'name'):
+        CatalogEntry.objects.filter(category_id=category_id).update(category_name=name)
+
+
+def retire_catalog_entries(product_info_ids):
+    CatalogEntry.objects.filter(product_info_id__in=product_info_ids).update(is_active=False)
+
+
+def rebuild_catalog(batch_size=1000):
+    """
+    Полная пересборка каталога для чтения пакетами по batch_size строк
+    """
+    last_id = 0
+    count = 0
+    while True:
+        ids = list(ProductInfo.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            refresh_facets(Shop.objects.values_list('id', flat=True))
+            refresh_stats(Shop.objects.values_list('id', flat=True))
+            return count
+        refresh_catalog_entries(ids)
+        count += len(ids)
+        last_id = ids[-1]
+
+
+def refresh_facets(shop_ids):
+    """
+    Пересборка индекса значений параметров по видимым строкам каталога магазинов
+    """
+    for shop_id in shop_ids:
+        facets = {}
+        for product_info_id, category_id, parameters in CatalogEntry.objects.filter(
+                shop_id=shop_id, shop_state=True, is_active=True
+        ).order_by('pk').values_list('product_info_id', 'category_id', 'parameters'):
+            for parameter in parameters:
+                key = (category_id, parameter['parameter'], parameter['value'])
+                facets.setdefault(key, []).append(product_info_id)
+        ParameterFacet.objects.filter(shop_id=shop_id).delete()
+        ParameterFacet.objects.bulk_create([
+            ParameterFacet(shop_id=shop_id, category_id=category_id, parameter=name, value=value, product_info_ids=ids)
+            for (category_id, name, value), ids in facets.items()
+        ], batch_size=settings.IMPORT_BATCH_SIZE)
+
+
+def get_shop_category_ids(shop_ids):
+    """
+    ИД категорий, в которых у магазинов есть товары или которые указаны в их прайсах
+    """
+    category_ids = set(CatalogEntry.objects.filter(shop_id__in=shop_ids).values_list(
+        'category_id', flat=True
+    ).distinct())
+    category_ids.update(
+        Category.shops.through.objects.filter(shop_id__in=shop_ids).values_list('category_id', flat=True)
+    )
+    return category_ids
+
+
+def refresh_stats(shop_ids, category_ids=()):
+    """
+    Пересчет показателей магазинов, категорий, в которых у этих магазинов
+    есть товары, и категорий category_ids. Каждая группа считается одним
+    агрегирующим запросом.
+    """
+    shop_ids = list(shop_ids)
+    aggregates = dict(
+        product_count=Count('pk'),
+        in_stock_count=Count('pk', filter=Q(quantity__gt=0)),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    )
+    empty = {'product_count': 0, 'in_stock_count': 0, 'price_min': None, 'price_max': None}
+    shops = {
+        row.pop('shop_id'): row
+        for row in CatalogEntry.objects.filter(shop_id__in=shop_ids, is_active=True).order_by().values(
+            'shop_id'
+        ).annotate(**aggregates)
+    }
+    for shop_id in shop_ids:
+        Shop.objects.filter(id=shop_id).update(**shops.get(shop_id, empty))
+    category_ids = get_shop_category_ids(shop_ids) | set(category_ids)
+    categories = {
+        row.pop('category_id'): row
+        for row in CatalogEntry.objects.filter(
+            category_id__in=category_ids, shop_state=True, is_active=True
+        ).order_by().values('category_id').annotate(**aggregates)
+    }
+    for category_id in category_ids:
+        Category.objects.filter(id=category_id).update(**categories.get(category_id, empty))
+
+
+def load_facets(shop_id=None, category_id=None, parameters=None):
+    """
+    Загрузка индекса значений параметров в виде {параметр: {значение: множество ИД}}.
+    Если передан список parameters, загружаются только эти параметры.
+    """
+    facets = ParameterFacet.objects.all()
+    if parameters is not None:
+        facets = facets.filter(parameter__in=parameters)
+    if shop_id:
+        facets = facets.filter(shop_id=shop_id)
+    if category_id:
+        facets = facets.filter(category_id=category_id)
+    index = {}
+    for name, value, ids in facets.values_list('parameter', 'value', 'product_info_ids'):
+        index.setdefault(name, {}).setdefault(value, set()).update(ids)
+    return index
+
+
+def filter_facets(index, parameters):
+    """
+    Множество ИД строк каталога, подходящих под фильтр {параметр: список значений}.
+    Значения одного параметра объединяются, разные параметры пересекаются.
+    """
+    selected = None
+    for name, values in parameters.items():
+        ids = set().union(*(index.get(name, {}).get(value, ()) for value in values))
+        selected = ids if selected is None else selected & ids
+    return selected
+
+
+def facet_filter(shop_id, category_id, parameters):
+    """
+    Условие отбора строк каталога по фильтру {параметр: список значений}
+    подзапросами к индексу значений параметров, поэтому список ИД в запрос
+    не передается при любом размере. Только для PostgreSQL.
+    """
+    query = Q()
+    for name, values in parameters.items():
+        facets = ParameterFacet.objects.filter(parameter=name, value__in=values)
+        if shop_id:
+            facets = facets.filter(shop_id=shop_id)
+        if category_id:
+            facets = facets.filter(category_id=category_id)
+        query &= Q(pk__in=facets.annotate(entry_id=Cast(
+            Func(F('product_info_ids'), function='jsonb_array_elements_text', output_field=CharField()),
+            BigIntegerField()
+        )).values('entry_id'))
+    return query
+
+
+def count_facets(index, ids=None, found=None):
+    """
+    Количество строк результата для каждого значения параметра.
+    Если ids не передан, результатом считается весь индекс.
+    found - поток ИД строк, отобранных запросом, например по цене или поиску.
+    Он обходится один раз и в множество не собирается: для каждого ИД из ids
+    увеличиваются счетчики значений, в которых он есть.
+    """
+    if found is not None:
+        keys = {}
+        for name, values in index.items():
+            for value, value_ids in values.items():
+                for product_info_id in value_ids:
+                    keys.setdefault(product_info_id, []).append((name, value))
+        found_counts = {}
+        for product_info_id in found:
+            if ids is None or product_info_id in ids:
+                for key in keys.get(product_info_id, ()):
+                    found_counts[key] = found_counts.get(key, 0) + 1
+    counts = {}
+    for name, values in sorted(index.items()):
+        counts[name] = {}
+        for value, value_ids in sorted(values.items()):
+            if found is not None:
+                count = found_counts.get((name, value), 0)
+            else:
+                count = len(value_ids if ids is None else value_ids & ids)
+            if count:
+                counts[name][value] = count
+    return {name: values for name, values in counts.items() if values}
+
+
+def search_catalog(queryset, text):
+    """
+    Поиск по названию продукта, модели и значениям параметров.
+    В PostgreSQL используется полнотекстовый индекс с ранжированием, а если
+    он ничего не нашел, например из-за опечатки, поиск похожих слов
+    по триграммному индексу (оператор %> с порогом
+    CATALOG_SEARCH_MIN_SIMILARITY) с ранжированием по word_similarity.
+    Возвращает queryset с аннотацией rank для сортировки.
+    """
+    if connection.vendor != 'postgresql':
+        for term in text.split():
+            queryset = queryset.filter(search_text__icontains=term)
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+    query = SearchQuery(text, config=settings.CATALOG_SEARCH_CONFIG, search_type='websearch')
+    matches = queryset.filter(search_vector=query)
+    if matches.exists():
+        return matches.annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)",
+            [str(settings.CATALOG_SEARCH_MIN_SIMILARITY)]
+        )
+    return queryset.filter(search_text__trigram_word_similar=text).annotate(
+        rank=TrigramWordSimilarity(text, 'search_text')
+    )
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@register(Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    """
+    Версии каталога, блокировки single flight и ответы должны храниться
+    в кеше, общем для всех процессов: сброс версий в кеше одного процесса
+    не виден остальным, и они отдают устаревшие ответы до истечения срока.
+    """
+    backend = settings.CACHES.get(settings.CATALOG_CACHE, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            f'Кеш каталога {settings.CATALOG_CACHE!r} хранится в памяти процесса',
+            hint='Укажите в CATALOG_CACHE общий кеш: базу данных, memcached или redis',
+            id='api.W001',
+        )]
+    return []
@@ -0,0 +1,37 @@
+import zlib
+from json import JSONEncoder
+from .fast_serializers import PRODUCT_INFO_FIELDS, get_catalog_entry_values, serialize_catalog_entries
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_catalog_export(queryset, fields=PRODUCT_INFO_FIELDS, chunk_size=2000):
+    """
+    Выгрузка строк каталога в формате NDJSON кусками байт. Строки читаются
+    курсором на сервере по chunk_size штук, параметры уже денормализованы
+    в строке каталога, поэтому память не зависит от размера каталога.
+    """
+    rows = queryset.order_by('pk').values(*get_catalog_entry_values(fields)).iterator(chunk_size=chunk_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield _encode(batch, fields)
+            batch = []
+    if batch:
+        yield _encode(batch, fields)
+
+
+def _encode(rows, fields):
+    return ''.join(_encoder.encode(item) + '\n' for item in serialize_catalog_entries(rows, fields)).encode()
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Сжатие потока кусков байт в gzip без накопления всего ответа в памяти.
+    Каждый кусок сбрасывается сразу, чтобы клиент получал данные без задержки.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
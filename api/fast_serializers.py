@@ -0,0 +1,170 @@
+"""
+Быстрая сериализация списков только для чтения. Данные выбираются через
+values и собираются в словари той же структуры и с тем же порядком
+ключей, что и у ProductInfoSerializer, CatalogEntrySerializer и
+OrderSerializer, поэтому отрендеренный ответ совпадает побайтно.
+Поддерживается выбор полей: невыбранные поля не выбираются из базы,
+а связанные таблицы не соединяются.
+"""
+from operator import itemgetter
+from rest_framework import serializers
+from .models import ProductInfo, ProductParameter, OrderItem, Contact
+
+PRODUCT_INFO_FIELDS = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters')
+EXPANDABLE_FIELDS = ('product', 'product_parameters')
+ORDER_FIELDS = ('id', 'ordered_items', 'status', 'dt', 'total_sum', 'contact')
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+_datetime = serializers.DateTimeField()
+
+
+def _product(name, category):
+    name, category = itemgetter(name), itemgetter(category)
+    return lambda row: {'name': name(row), 'category': category(row)}
+
+
+def _column(name):
+    return (name,), itemgetter(name)
+
+
+CATALOG_ENTRY_COLUMNS = {
+    'id': _column('pk'),
+    'model': _column('model'),
+    'product': (('product_name', 'category_name'), _product('product_name', 'category_name')),
+    'shop': _column('shop_id'),
+    'quantity': _column('quantity'),
+    'price': _column('price'),
+    'price_rrc': _column('price_rrc'),
+    'product_parameters': _column('parameters'),
+}
+PRODUCT_INFO_COLUMNS = {
+    'id': _column('id'),
+    'model': _column('model'),
+    'product': (('product__name', 'product__category__name'), _product('product__name', 'product__category__name')),
+    'shop': _column('shop_id'),
+    'quantity': (('quantity', 'reserved'), lambda row: max(row['quantity'] - row['reserved'], 0)),
+    'price': _column('price'),
+    'price_rrc': _column('price_rrc'),
+}
+ORDER_COLUMNS = {
+    'status': 'status',
+    'dt': 'dt',
+    'total_sum': 'total_sum',
+    'contact': 'contact_id',
+}
+
+
+def _split(value):
+    return {item.strip() for item in value.split(',') if item.strip()} if value else set()
+
+
+def get_fields(fields, expand, allowed, expandable=()):
+    """
+    Список выводимых полей по параметрам запроса fields и expand.
+    Без параметров выводятся все поля allowed. Если задан fields, выводятся
+    только перечисленные поля, иначе все поля, кроме вложенных expandable.
+    Вложенные поля, перечисленные в expand, выводятся всегда.
+    Для неизвестных полей вызывается ValueError.
+    """
+    requested, expanded = _split(fields), _split(expand)
+    unknown = (requested - set(allowed)) | (expanded - set(expandable))
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    if not requested and not expanded:
+        return tuple(allowed)
+    selected = requested or set(allowed) - set(expandable)
+    return tuple(name for name in allowed if name in selected or name in expanded)
+
+
+def get_catalog_entry_values(fields=PRODUCT_INFO_FIELDS):
+    """
+    Столбцы CatalogEntry, необходимые для вывода полей fields
+    """
+    return tuple(column for name in fields for column in CATALOG_ENTRY_COLUMNS[name][0])
+
+
+CATALOG_ENTRY_VALUES = get_catalog_entry_values()
+
+
+def serialize_catalog_entries(rows, fields=PRODUCT_INFO_FIELDS):
+    """
+    Аналог CatalogEntrySerializer(..., many=True).data для строк
+    queryset.values(*get_catalog_entry_values(fields))
+    """
+    getters = [(name, CATALOG_ENTRY_COLUMNS[name][1]) for name in fields]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
+def get_product_infos(product_info_ids, fields=PRODUCT_INFO_FIELDS):
+    """
+    Словарь {ИД: данные ProductInfoSerializer}. Продукт и категория
+    соединяются, а параметры выбираются, только если они выводятся.
+    """
+    parameters = {}
+    if 'product_parameters' in fields:
+        for product_info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in=product_info_ids
+        ).order_by('id').values_list('product_info_id', 'parameter__name', 'value'):
+            parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    getters = [
+        (name, PRODUCT_INFO_COLUMNS[name][1] if name in PRODUCT_INFO_COLUMNS else
+         lambda row: parameters.get(row['id'], []))
+        for name in fields
+    ]
+    columns = {'id'}.union(*(PRODUCT_INFO_COLUMNS[name][0] for name in fields if name in PRODUCT_INFO_COLUMNS))
+    return {
+        row['id']: {name: getter(row) for name, getter in getters}
+        for row in ProductInfo.objects.filter(id__in=product_info_ids).values(*columns)
+    }
+
+
+def serialize_product_infos(queryset, fields=PRODUCT_INFO_FIELDS):
+    """
+    Аналог ProductInfoSerializer(queryset, many=True).data
+    """
+    ids = list(queryset.values_list('id', flat=True))
+    product_infos = get_product_infos(ids, fields)
+    return [product_infos[product_info_id] for product_info_id in ids]
+
+
+def serialize_orders(orders, fields=ORDER_FIELDS, product_fields=PRODUCT_INFO_FIELDS):
+    """
+    Аналог OrderSerializer(..., many=True).data. orders - queryset заказов
+    или уже выбранный список заказов; для поля total_sum заказы должны
+    иметь одноименную аннотацию. Позиции, товары и контакты выбираются
+    отдельными запросами пакетно и только если они выводятся.
+    """
+    columns = ['id', *(ORDER_COLUMNS[name] for name in fields if name in ORDER_COLUMNS)]
+    if isinstance(orders, list):
+        rows = [{column: getattr(order, column) for column in columns} for order in orders]
+    else:
+        rows = list(orders.values(*columns))
+    items, product_infos, contacts = {}, {}, {}
+    if 'ordered_items' in fields:
+        for order_id, item_id, product_info_id, quantity in OrderItem.objects.filter(
+                order_id__in=[row['id'] for row in rows]
+        ).order_by('id').values_list('order_id', 'id', 'product_info_id', 'quantity'):
+            items.setdefault(order_id, []).append((item_id, product_info_id, quantity))
+        product_info_ids = {item[1] for order_items in items.values() for item in order_items}
+        if product_info_ids:
+            product_infos = get_product_infos(product_info_ids, product_fields)
+    if 'contact' in fields:
+        contact_ids = {row['contact_id'] for row in rows if row['contact_id'] is not None}
+        if contact_ids:
+            contacts = {
+                contact['id']: contact
+                for contact in Contact.objects.filter(id__in=contact_ids).values(*CONTACT_FIELDS)
+            }
+    getters = {
+        'id': itemgetter('id'),
+        'ordered_items': lambda row: [
+            {'id': item_id, 'product_info': product_infos[product_info_id], 'quantity': quantity}
+            for item_id, product_info_id, quantity in items.get(row['id'], ())
+        ],
+        'status': itemgetter('status'),
+        'dt': lambda row: _datetime.to_representation(row['dt']),
+        'total_sum': lambda row: None if row['total_sum'] is None else int(row['total_sum']),
+        'contact': lambda row: contacts.get(row['contact_id']),
+    }
+    getters = [(name, getters[name]) for name in fields]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
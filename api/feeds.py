@@ -0,0 +1,228 @@
+import gzip
+import os
+import zlib
+from contextlib import suppress
+from hashlib import sha256
+from json import loads as load_json
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from django.conf import settings
+from yaml.events import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, \
+    MappingStartEvent, MappingEndEvent, StreamEndEvent
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+
+try:
+    from yaml import CSafeLoader as FeedLoader
+except ImportError:
+    from yaml import SafeLoader as FeedLoader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+SECTIONS = ('categories', 'goods')
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+class FeedError(ValueError):
+    pass
+
+
+class UnsupportedEncoding(FeedError):
+    pass
+
+
+class FeedTooLarge(FeedError):
+    pass
+
+
+def is_ndjson(content_type=None, name=None):
+    """
+    Определение формата NDJSON по типу содержимого или имени файла
+    """
+    if content_type and content_type.split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES:
+        return True
+    return bool(name) and name.split('?')[0].lower().endswith(NDJSON_EXTENSIONS)
+
+
+def encoding_from_name(name):
+    """
+    Определение сжатия по расширению файла. Возвращает сжатие и имя без расширения сжатия.
+    """
+    for extension, encoding in COMPRESSED_EXTENSIONS.items():
+        if name and name.lower().endswith(extension):
+            return encoding, name[:-len(extension)]
+    return None, name
+
+
+def decompress_stream(stream, encoding=None):
+    """
+    Потоковая распаковка тела запроса по значению Content-Encoding
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return stream
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise UnsupportedEncoding('Для сжатия zstd требуется пакет zstandard')
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedEncoding(f'Неподдерживаемое сжатие: {encoding}')
+
+
+def spool_stream(stream, chunk_size=64 * 1024, spool=None):
+    """
+    Копирование потока во временный файл с подсчетом хеша содержимого.
+    По умолчанию файл держится в памяти, пока не превысит IMPORT_SPOOL_MAX_MEMORY.
+    Если распакованное содержимое больше IMPORT_MAX_FEED_SIZE, файл закрывается
+    и вызывается FeedTooLarge.
+    Возвращает файл, перемотанный в начало, и SHA-256 содержимого.
+    """
+    if spool is None:
+        spool = SpooledTemporaryFile(max_size=settings.IMPORT_SPOOL_MAX_MEMORY)
+    digest = sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            size += len(chunk)
+            if size > settings.IMPORT_MAX_FEED_SIZE:
+                raise FeedTooLarge(f'Размер прайса превышает {settings.IMPORT_MAX_FEED_SIZE} байт')
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def spool_upload(stream, directory=None):
+    """
+    Копирование потока в именованный файл каталога directory. Файл не удаляется
+    при закрытии и переживает перезапуск процесса, поэтому задачу импорта
+    может выполнить любой обработчик очереди. При ошибке файл удаляется.
+    Возвращает путь к файлу и SHA-256 содержимого.
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    spool = NamedTemporaryFile(dir=directory, prefix='feed-', delete=False)
+    try:
+        with spool:
+            _, digest = spool_stream(stream, spool=spool)
+    except BaseException:
+        remove_upload(spool.name)
+        raise
+    return spool.name, digest
+
+
+def remove_upload(path):
+    """
+    Удаление файла загруженного прайса, если он еще существует
+    """
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def iter_feed(stream, content_type=None, name=None):
+    """
+    Потоковое чтение прайса из байтового потока.
+    Возвращает пары (раздел, значение): ('shop', имя магазина),
+    ('categories', категория) и ('goods', товар) по одной записи за раз.
+    Документы JSON разбираются тем же парсером, что и YAML.
+    """
+    if is_ndjson(content_type, name):
+        return _iter_ndjson(stream)
+    return _iter_yaml(stream)
+
+
+def _iter_ndjson(stream):
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = load_json(line)
+        except ValueError as e:
+            raise FeedError(f'Строка {number}: {e}')
+        if not isinstance(record, dict):
+            raise FeedError(f'Строка {number}: ожидается объект')
+        for section, value in record.items():
+            if section in SECTIONS and isinstance(value, list):
+                for entry in value:
+                    yield section, entry
+            else:
+                yield section, value
+
+
+def _iter_yaml(stream):
+    loader = FeedLoader(stream)
+    anchors = {}
+    try:
+        loader.get_event()
+        if loader.check_event(StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise FeedError('Прайс должен быть словарем с разделами shop, categories и goods')
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            section = loader.construct_document(_compose_node(loader, anchors))
+            if section in SECTIONS and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield section, loader.construct_document(_compose_node(loader, anchors))
+                loader.get_event()
+            else:
+                yield section, loader.construct_document(_compose_node(loader, anchors))
+    finally:
+        loader.dispose()
+
+
+def _compose_node(loader, anchors):
+    """
+    Сборка узла YAML из событий парсера. В отличие от стандартного Composer
+    работает и с C-парсером, что позволяет собирать разделы прайса по одной записи.
+    Узлы с якорями сохраняются в anchors для последующих ссылок.
+    """
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise FeedError(f'Не найден якорь {event.anchor}')
+        return anchors[event.anchor]
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        return node
+    if isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    if isinstance(event, MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(MappingEndEvent):
+            key = _compose_node(loader, anchors)
+            node.value.append((key, _compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    raise FeedError(f'Неподдерживаемый элемент прайса: {event}')
@@ -0,0 +1,258 @@
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from .catalog import refresh_catalog_entries, refresh_shop_entries, refresh_category_entries, \
+    retire_catalog_entries, refresh_facets, refresh_stats
+from .feeds import FeedError
+from .models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter
+
+
+class QueryCounter:
+    """
+    Счетчик SQL-запросов, выполненных через соединение
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+PRODUCT_INFO_FIELDS = ['product', 'model', 'price', 'price_rrc', 'quantity', 'is_active']
+
+
+class CatalogImporter:
+    """
+    Класс для пакетного импорта прайса поставщика
+    """
+
+    def __init__(self, user_id, batch_size=None, progress=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.progress = progress
+        self.parameters = {}
+        self.shop = None
+
+    def run(self, entries):
+        """
+        Импорт прайса из потока пар (раздел, значение) в одной транзакции.
+        В памяти одновременно находится не более batch_size записей.
+        Возвращает статистику импорта.
+        """
+        counter = QueryCounter()
+        started = time.monotonic()
+        categories, goods = [], []
+        categories_count = goods_count = 0
+        self.seen = set()
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'retired': 0}
+        with connection.execute_wrapper(counter), transaction.atomic():
+            for section, entry in entries:
+                if section == 'shop':
+                    self._get_shop(entry)
+                elif section == 'categories':
+                    categories.append(entry)
+                    if len(categories) >= self.batch_size:
+                        self._import_categories(self._get_shop(), categories)
+                        categories_count += len(categories)
+                        categories = []
+                elif section == 'goods':
+                    if categories:
+                        self._import_categories(self._get_shop(), categories)
+                        categories_count += len(categories)
+                        categories = []
+                    goods.append(entry)
+                    if len(goods) >= self.batch_size:
+                        self._import_goods(self._get_shop(), goods)
+                        goods_count += len(goods)
+                        goods = []
+                        if self.progress:
+                            self.progress(categories_count + goods_count)
+            if categories:
+                self._import_categories(self._get_shop(), categories)
+                categories_count += len(categories)
+            if goods:
+                self._import_goods(self._get_shop(), goods)
+                goods_count += len(goods)
+            shop = self._get_shop()
+            self._retire_missing(shop)
+            refresh_facets([shop.id])
+            refresh_stats([shop.id])
+        return {
+            'shop': shop.id,
+            'categories': categories_count,
+            'goods': goods_count,
+            **self.counts,
+            'queries': counter.count,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+    def _get_shop(self, name=None):
+        if self.shop is None:
+            if name is None:
+                self.shop = Shop.objects.filter(user_id=self.user_id).first()
+                if self.shop is None:
+                    raise FeedError('Не указано название магазина')
+            else:
+                self.shop, _ = Shop.objects.get_or_create(
+                    user_id=self.user_id,
+                    defaults={'name': name}
+                )
+        if name is not None and self.shop.name != name:
+            self.shop.name = name
+            self.shop.save(update_fields=['name'])
+            refresh_shop_entries([self.shop.id])
+        return self.shop
+
+    def _import_categories(self, shop, batch):
+        names = {int(category['id']): category['name'] for category in batch}
+        existing = Category.objects.in_bulk(list(names))
+        Category.objects.bulk_create([
+            Category(id=category_id, name=name)
+            for category_id, name in names.items() if category_id not in existing
+        ])
+        renamed = []
+        for category in existing.values():
+            if category.name != names[category.id]:
+                category.name = names[category.id]
+                renamed.append(category)
+        if renamed:
+            Category.objects.bulk_update(renamed, ['name'])
+            refresh_category_entries([category.id for category in renamed])
+        through = Category.shops.through
+        through.objects.bulk_create([
+            through(category_id=category_id, shop_id=shop.id) for category_id in names
+        ], ignore_conflicts=True)
+
+    def _import_goods(self, shop, batch):
+        """
+        Синхронизация пакета товаров с уже загруженными строками магазина по внешнему ИД.
+        Изменяются только строки, у которых отличаются поля или параметры.
+        """
+        items = {int(item['id']): item for item in batch}
+        self.seen.update(items)
+        products = self._product_ids({(item['name'], int(item['category'])) for item in items.values()})
+        parameters = self._parameter_ids({name for item in items.values() for name in item['parameters']})
+        existing = {
+            product_info.external_id: product_info
+            for product_info in ProductInfo.objects.filter(shop_id=shop.id, external_id__in=list(items))
+        }
+        existing_parameters = {}
+        for parameter_id, product_info_id, parameter, value in ProductParameter.objects.filter(
+                product_info_id__in=[product_info.id for product_info in existing.values()]
+        ).values_list('id', 'product_info_id', 'parameter_id', 'value'):
+            existing_parameters.setdefault(product_info_id, {})[parameter] = (parameter_id, value)
+
+        created, changed = [], []
+        for external_id, item in items.items():
+            fields = {
+                'product_id': products[(item['name'], int(item['category']))],
+                'model': item['model'],
+                'price': item['price'],
+                'price_rrc': item['price_rrc'],
+                'quantity': item['quantity'],
+                'is_active': True,
+            }
+            product_info = existing.get(external_id)
+            if product_info is None:
+                created.append(ProductInfo(external_id=external_id, shop_id=shop.id, **fields))
+            elif any(getattr(product_info, name) != value for name, value in fields.items()):
+                for name, value in fields.items():
+                    setattr(product_info, name, value)
+                changed.append(product_info)
+        if changed:
+            ProductInfo.objects.bulk_update(changed, PRODUCT_INFO_FIELDS)
+        if created:
+            ProductInfo.objects.bulk_create(created)
+            if not all(product_info.pk for product_info in created):
+                ids = dict(ProductInfo.objects.filter(
+                    shop_id=shop.id,
+                    external_id__in=[product_info.external_id for product_info in created]
+                ).values_list('external_id', 'id'))
+                for product_info in created:
+                    product_info.pk = ids[product_info.external_id]
+
+        parameters_created, parameters_changed, parameters_deleted = [], [], []
+        parameters_updated = set()
+        for product_info in list(existing.values()) + created:
+            current = existing_parameters.get(product_info.pk, {})
+            wanted = {
+                parameters[name]: str(value)
+                for name, value in items[product_info.external_id]['parameters'].items()
+            }
+            for parameter, value in wanted.items():
+                if parameter not in current:
+                    parameters_created.append(ProductParameter(
+                        product_info_id=product_info.pk,
+                        parameter_id=parameter,
+                        value=value
+                    ))
+                    parameters_updated.add(product_info.pk)
+                elif current[parameter][1] != value:
+                    parameters_changed.append(ProductParameter(
+                        id=current[parameter][0],
+                        product_info_id=product_info.pk,
+                        parameter_id=parameter,
+                        value=value
+                    ))
+                    parameters_updated.add(product_info.pk)
+            for parameter, (parameter_id, _) in current.items():
+                if parameter not in wanted:
+                    parameters_deleted.append(parameter_id)
+                    parameters_updated.add(product_info.pk)
+        if parameters_deleted:
+            ProductParameter.objects.filter(id__in=parameters_deleted).delete()
+        if parameters_changed:
+            ProductParameter.objects.bulk_update(parameters_changed, ['value'])
+        if parameters_created:
+            ProductParameter.objects.bulk_create(parameters_created)
+
+        updated = {product_info.pk for product_info in changed} | (parameters_updated - {
+            product_info.pk for product_info in created
+        })
+        refresh_catalog_entries(updated | {product_info.pk for product_info in created})
+        self.counts['created'] += len(created)
+        self.counts['updated'] += len(updated)
+        self.counts['unchanged'] += len(existing) - len(updated)
+
+    def _retire_missing(self, shop):
+        """
+        Снятие с продажи товаров магазина, которых нет в прайсе. Строки не удаляются,
+        чтобы не затрагивать позиции заказов.
+        """
+        missing = [
+            product_info_id for product_info_id, external_id in ProductInfo.objects.filter(
+                shop_id=shop.id,
+                is_active=True
+            ).values_list('id', 'external_id').iterator() if external_id not in self.seen
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            ProductInfo.objects.filter(id__in=missing[start:start + self.batch_size]).update(is_active=False)
+            retire_catalog_entries(missing[start:start + self.batch_size])
+        self.counts['retired'] = len(missing)
+
+    def _product_ids(self, keys):
+        queryset = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}
+        ).values_list('name', 'category_id', 'id')
+        ids = {(name, category_id): product_id for name, category_id, product_id in queryset}
+        missing = [Product(name=name, category_id=category_id) for name, category_id in keys - ids.keys()]
+        if missing:
+            Product.objects.bulk_create(missing)
+            if all(product.pk for product in missing):
+                ids.update({(product.name, product.category_id): product.pk for product in missing})
+            else:
+                ids = {(name, category_id): product_id for name, category_id, product_id in queryset.all()}
+        return ids
+
+    def _parameter_ids(self, names):
+        missing = names - self.parameters.keys()
+        if missing:
+            self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+            missing = missing - self.parameters.keys()
+            if missing:
+                Parameter.objects.bulk_create([Parameter(name=name) for name in missing])
+                self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.parameters
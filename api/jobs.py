@@ -0,0 +1,291 @@
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from yaml import YAMLError
+from .cache import bump_catalog_versions
+from .feeds import iter_feed, spool_stream, remove_upload
+from .importer import CatalogImporter
+from .models import Shop, ImportJob, IMPORT_ACTIVE_STATUSES
+from .snapshot import rebuild_snapshot
+
+_executor = None
+_executor_lock = threading.Lock()
+_rebuild_pending = False
+
+
+def get_executor():
+    """
+    Пул потоков для выполнения задач импорта в текущем процессе
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMPORT_JOB_WORKERS,
+                thread_name_prefix='import-job'
+            )
+        return _executor
+
+
+def expire_stale_jobs(user_id):
+    """
+    Перевод зависших задач пользователя в статус ошибки, например после
+    остановки обработчика посреди импорта. Их загруженные прайсы удаляются.
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)
+    jobs = ImportJob.objects.filter(
+        user_id=user_id,
+        status__in=IMPORT_ACTIVE_STATUSES,
+        created_at__lt=deadline
+    )
+    uploads = list(jobs.exclude(upload='').values_list('upload', flat=True))
+    jobs.update(status='failed', phase='failed', errors=['Превышено время выполнения'], upload='',
+                finished_at=timezone.now())
+    for path in uploads:
+        remove_upload(path)
+
+
+def get_or_create_job(user_id, url=None):
+    """
+    Создание задачи импорта. Если у пользователя уже есть активная задача,
+    возвращается она. Возвращает пару (задача, создана ли новая).
+    """
+    expire_stale_jobs(user_id)
+    try:
+        with transaction.atomic():
+            return ImportJob.objects.create(user_id=user_id, url=url, phase='queued'), True
+    except IntegrityError:
+        return ImportJob.objects.filter(user_id=user_id, status__in=IMPORT_ACTIVE_STATUSES).first(), False
+
+
+def claim_job(job_id=None):
+    """
+    Захват задачи из очереди: самая ранняя задача в статусе queued переводится
+    в running. Строки блокируются с пропуском уже заблокированных, поэтому
+    обработчики, в том числе в разных процессах, не получают одну задачу дважды.
+    Задача загрузки прайса, у которой еще нет ни ссылки, ни файла, принимает
+    тело запроса и не захватывается. Возвращает задачу или None.
+    """
+    with transaction.atomic():
+        jobs = ImportJob.objects.select_for_update(skip_locked=True).filter(
+            status='queued'
+        ).exclude(url__isnull=True, upload='')
+        if job_id is not None:
+            jobs = jobs.filter(id=job_id)
+        job = jobs.order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        job.status = 'running'
+        job.phase = 'fetching'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'phase', 'started_at'])
+    return job
+
+
+def run_queued_jobs():
+    """
+    Выполнение задач из очереди, пока она не опустеет. Непредвиденная ошибка
+    импорта записывается в задачу и не останавливает обработку остальных.
+    Возвращает список выполненных задач.
+    """
+    jobs = []
+    while True:
+        job = claim_job()
+        if job is None:
+            return jobs
+        try:
+            execute_job(job)
+        except Exception:
+            pass
+        jobs.append(job)
+
+
+def submit_job(job):
+    """
+    Запуск обработчика очереди после фиксации задачи. Задача остается в таблице
+    в статусе queued, пока ее не захватит обработчик этого или другого процесса,
+    поэтому перезапуск процесса ее не теряет.
+    При IMPORT_JOB_WORKERS = 0 задача выполняется сразу в текущем потоке.
+    """
+    if settings.IMPORT_JOB_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(_run_queued_in_thread))
+    else:
+        run_job(job.id)
+
+
+def _run_queued_in_thread():
+    try:
+        run_queued_jobs()
+    finally:
+        connection.close()
+
+
+def submit_snapshot_rebuild():
+    """
+    Пересборка снимка каталога после фиксации транзакции в пуле задач.
+    Пока поставленная пересборка не началась, новые не ставятся: она и так
+    прочитает все уже зафиксированные изменения.
+    При IMPORT_JOB_WORKERS = 0 снимок пересобирается сразу.
+    """
+    if not settings.CATALOG_SNAPSHOT_PATH:
+        return
+    if settings.IMPORT_JOB_WORKERS:
+        transaction.on_commit(_queue_rebuild)
+    else:
+        rebuild_snapshot()
+
+
+def _queue_rebuild():
+    global _rebuild_pending
+    with _executor_lock:
+        if _rebuild_pending:
+            return
+        _rebuild_pending = True
+    get_executor().submit(_rebuild_in_thread)
+
+
+def _rebuild_in_thread():
+    global _rebuild_pending
+    with _executor_lock:
+        _rebuild_pending = False
+    try:
+        rebuild_snapshot()
+    finally:
+        connection.close()
+
+
+def _update_job(job_id, **fields):
+    ImportJob.objects.filter(id=job_id).update(**fields)
+
+
+def _update_job_in_thread(job_id, fields):
+    try:
+        _update_job(job_id, **fields)
+    finally:
+        connection.close()
+
+
+def _report_progress(job_id, **fields):
+    """
+    Обновление прогресса задачи. Импорт выполняется в одной транзакции,
+    поэтому в фоновом режиме прогресс пишется через отдельное соединение,
+    чтобы он был виден до ее завершения. SQLite допускает только одну
+    пишущую транзакцию, поэтому для нее прогресс пишется в текущую.
+    """
+    if settings.IMPORT_JOB_WORKERS and connection.in_atomic_block and connection.vendor != 'sqlite':
+        thread = threading.Thread(target=_update_job_in_thread, args=(job_id, fields))
+        thread.start()
+        thread.join()
+    else:
+        _update_job(job_id, **fields)
+
+
+def fetch_feed(url, shop=None):
+    """
+    Загрузка прайса во временный файл. Если прайс уже загружался с этого адреса,
+    отправляется условный запрос. Возвращает None, если прайс не изменился.
+    """
+    headers = {}
+    if shop is not None and shop.url == url:
+        if shop.feed_etag:
+            headers['If-None-Match'] = shop.feed_etag
+        if shop.feed_last_modified:
+            headers['If-Modified-Since'] = shop.feed_last_modified
+    with requests.get(url, headers=headers, stream=True, timeout=settings.IMPORT_FETCH_TIMEOUT) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        response.raw.decode_content = True
+        spool, digest = spool_stream(response.raw)
+        return {
+            'file': spool,
+            'hash': digest,
+            'content_type': response.headers.get('Content-Type'),
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+        }
+
+
+def import_feed(job, shop, feed, name=None):
+    """
+    Импорт загруженного прайса. Импорт пропускается, если хеш содержимого
+    совпадает с хешем последнего импортированного прайса магазина.
+    """
+    if shop is not None and shop.feed_hash == feed['hash']:
+        stats = {'skipped': True, 'reason': 'Содержимое прайса не изменилось'}
+        shop_id = shop.id
+    else:
+        importer = CatalogImporter(
+            job.user_id,
+            progress=lambda rows: _report_progress(job.id, phase='importing', rows_processed=rows)
+        )
+        stats = importer.run(iter_feed(feed['file'], feed['content_type'], name))
+        shop_id = stats['shop']
+    fields = {'feed_hash': feed['hash'], 'feed_etag': feed['etag'], 'feed_last_modified': feed['last_modified']}
+    if job.url:
+        fields['url'] = job.url
+    Shop.objects.filter(id=shop_id).update(**fields)
+    return shop_id, stats
+
+
+def open_upload(job):
+    """
+    Прайс, сохраненный при загрузке в теле запроса, в виде загруженного прайса
+    """
+    return {**job.feed, 'file': open(job.upload, 'rb'), 'etag': '', 'last_modified': ''}
+
+
+def run_job(job_id):
+    """
+    Захват задачи из очереди по ИД и ее выполнение. Если задачу уже захватил
+    другой обработчик, она возвращается без выполнения.
+    """
+    job = claim_job(job_id)
+    if job is None:
+        return ImportJob.objects.get(id=job_id)
+    return execute_job(job)
+
+
+def execute_job(job):
+    """
+    Загрузка и импорт прайса по захваченной задаче. Загруженный в теле
+    запроса прайс читается из файла задачи, после импорта файл удаляется.
+    """
+    shop = Shop.objects.filter(user_id=job.user_id).first()
+    try:
+        if job.upload:
+            feed = open_upload(job)
+        else:
+            feed = fetch_feed(job.url, shop)
+        if feed is None:
+            job.shop = shop
+            job.stats = {'skipped': True, 'reason': 'Прайс не изменился (HTTP 304)'}
+        else:
+            with feed['file']:
+                job.shop_id, job.stats = import_feed(job, shop, feed, feed.get('name', job.url))
+            job.rows_processed = job.stats.get('categories', 0) + job.stats.get('goods', 0)
+            if not job.skipped:
+                bump_catalog_versions([job.shop_id], categories=True, shops=True, snapshot=True)
+                rebuild_snapshot()
+    except requests.RequestException as e:
+        job.errors = [str(e)]
+    except FileNotFoundError:
+        job.errors = ['Файл загруженного прайса не найден']
+    except (YAMLError, KeyError, ValueError) as e:
+        job.errors = [f'Неверный формат прайса: {e}']
+    except Exception as e:
+        job.errors = [str(e)]
+        raise
+    finally:
+        if job.upload:
+            remove_upload(job.upload)
+            job.upload = ''
+        job.status = job.phase = 'failed' if job.errors else 'done'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['shop', 'upload', 'status', 'phase', 'rows_processed', 'errors', 'stats',
+                                'finished_at'])
+    return job
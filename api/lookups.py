@@ -0,0 +1,27 @@
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.db.models import FloatField, Func, Value
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    Поле содержит слово, похожее на значение: field %> value, то есть
+    word_similarity(value, field) выше pg_trgm.word_similarity_threshold.
+    Выполняется по индексу gin_trgm_ops.
+    """
+
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    """
+    Наибольшая похожесть строки на слово выражения (функция word_similarity)
+    """
+
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Сборка снимка каталога для чтения через mmap
+    """
+
+    help = 'Сборка снимка видимого каталога в файл CATALOG_SNAPSHOT_PATH'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Путь к файлу снимка, по умолчанию CATALOG_SNAPSHOT_PATH')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.CATALOG_SNAPSHOT_PATH
+        if not path:
+            raise CommandError('Не задан путь к снимку каталога')
+        count = build_snapshot(path, settings.CATALOG_EXPORT_CHUNK_SIZE)
+        self.stdout.write(f'Строк в снимке каталога: {count}')
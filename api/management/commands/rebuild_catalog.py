@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.cache import bump_catalog_versions
+from api.catalog import rebuild_catalog
+from api.models import Shop
+from api.snapshot import rebuild_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Полная пересборка каталога для чтения
+    """
+
+    help = 'Пересборка денормализованного каталога для чтения из ProductInfo'
+
+    def handle(self, *args, **options):
+        count = rebuild_catalog(settings.IMPORT_BATCH_SIZE)
+        bump_catalog_versions(Shop.objects.values_list('id', flat=True), categories=True, shops=True, snapshot=True)
+        rebuild_snapshot()
+        self.stdout.write(f'Пересобрано строк каталога: {count}')
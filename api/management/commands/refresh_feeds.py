@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api.jobs import get_or_create_job, run_job
+from api.models import Shop
+
+
+class Command(BaseCommand):
+    """
+    Периодическое обновление прайсов всех магазинов по сохраненным ссылкам
+    """
+
+    help = 'Обновление прайсов магазинов по сохраненным ссылкам по расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.FEED_REFRESH_INTERVAL,
+                            help='Период обновления в секундах')
+        parser.add_argument('--workers', type=int, default=settings.FEED_REFRESH_WORKERS,
+                            help='Количество одновременных импортов, 0 - импорт в текущем потоке')
+        parser.add_argument('--per-host', type=int, default=settings.FEED_REFRESH_PER_HOST,
+                            help='Количество одновременных загрузок с одного хоста')
+        parser.add_argument('--jitter', type=float, default=settings.FEED_REFRESH_JITTER,
+                            help='Максимальная случайная задержка перед загрузкой в секундах')
+        parser.add_argument('--backoff', type=int, default=settings.FEED_REFRESH_BACKOFF,
+                            help='Начальная пауза после ошибки импорта в секундах')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить один цикл обновления и завершиться')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+        self.failures = {}
+        self.retry_at = {}
+        while True:
+            started = time.monotonic()
+            results = self.refresh()
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Обновлено: {results.count("done")}, пропущено: {results.count("skipped")}, '
+                f'ошибок: {results.count("failed")}, время: {elapsed:.1f} с'
+            )
+            if options['once']:
+                break
+            time.sleep(max(options['interval'] - elapsed, 0))
+
+    def refresh(self):
+        now = time.monotonic()
+        shops = [
+            shop for shop in Shop.objects.filter(
+                url__isnull=False,
+                user__isnull=False
+            ).exclude(url='').values('id', 'user_id', 'url')
+            if self.retry_at.get(shop['id'], 0) <= now
+        ]
+        if not self.options['workers']:
+            return [self.refresh_shop(shop) for shop in shops]
+        with ThreadPoolExecutor(max_workers=self.options['workers'], thread_name_prefix='feed-refresh') as executor:
+            return list(executor.map(self.refresh_shop_in_thread, shops))
+
+    def refresh_shop_in_thread(self, shop):
+        try:
+            return self.refresh_shop(shop)
+        finally:
+            connection.close()
+
+    def refresh_shop(self, shop):
+        """
+        Импорт прайса одного магазина с ограничением числа загрузок с хоста.
+        После ошибки следующая попытка откладывается с экспоненциальным ростом паузы.
+        Непредвиденная ошибка импорта считается ошибкой этого магазина
+        и не прерывает цикл обновления остальных.
+        """
+        if self.options['jitter']:
+            time.sleep(random.uniform(0, self.options['jitter']))
+        try:
+            with self.host_semaphore(urlsplit(shop['url']).hostname):
+                job, created = get_or_create_job(shop['user_id'], shop['url'])
+                if not created:
+                    return 'skipped'
+                job = run_job(job.id)
+        except Exception as e:
+            return self.fail(shop, [f'{type(e).__name__}: {e}'])
+        if job.status == 'failed':
+            return self.fail(shop, job.errors)
+        if job.status != 'done':
+            return 'skipped'
+        self.failures.pop(shop['id'], None)
+        self.retry_at.pop(shop['id'], None)
+        return 'skipped' if job.skipped else 'done'
+
+    def fail(self, shop, errors):
+        failures = self.failures.get(shop['id'], 0) + 1
+        self.failures[shop['id']] = failures
+        delay = min(self.options['backoff'] * 2 ** (failures - 1), settings.FEED_REFRESH_BACKOFF_MAX)
+        self.retry_at[shop['id']] = time.monotonic() + delay * random.uniform(1, 1.5)
+        self.stderr.write(f'Магазин {shop["id"]}: {"; ".join(errors)}')
+        return 'failed'
+
+    def host_semaphore(self, host):
+        with self.hosts_lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(max(self.options['per_host'], 1))
+            return self.hosts[host]
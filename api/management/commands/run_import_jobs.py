@@ -0,0 +1,33 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.jobs import run_queued_jobs
+
+
+class Command(BaseCommand):
+    """
+    Обработчик очереди задач импорта. Задачи захватываются из таблицы задач,
+    поэтому обработчиков можно запустить несколько, в том числе на разных
+    серверах с общим каталогом IMPORT_UPLOAD_DIR. Задачи, оставшиеся в очереди
+    после перезапуска веб-процессов, выполняются при следующем опросе.
+    """
+
+    help = 'Выполнение задач импорта прайсов из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.IMPORT_QUEUE_POLL_INTERVAL,
+                            help='Период опроса очереди в секундах')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи, стоящие в очереди, и завершиться')
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = run_queued_jobs()
+            if jobs:
+                self.stdout.write(
+                    f'Выполнено задач: {sum(job.status == "done" for job in jobs)}, '
+                    f'ошибок: {sum(job.status == "failed" for job in jobs)}'
+                )
+            if options['once']:
+                break
+            time.sleep(options['interval'])
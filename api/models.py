@@ -1,7 +1,10 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -139,7 +142,35 @@ class ConfirmEmailToken(models.Model):
         return f'Password reset token for user {self.user}'
 
 
-class Shop(models.Model):
+class CatalogStats(models.Model):
+    """
+    Предрассчитанные показатели видимых товаров. Обновляются импортом
+    прайса и сменой статуса магазина, а не считаются при каждом запросе.
+    """
+    product_count = models.PositiveIntegerField(
+        verbose_name='Количество товаров',
+        default=0
+    )
+    in_stock_count = models.PositiveIntegerField(
+        verbose_name='Количество товаров в наличии',
+        default=0
+    )
+    price_min = models.PositiveIntegerField(
+        verbose_name='Минимальная цена',
+        null=True,
+        blank=True
+    )
+    price_max = models.PositiveIntegerField(
+        verbose_name='Максимальная цена',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        abstract = True
+
+
+class Shop(CatalogStats):
     name = models.CharField(
         max_length=50,
         verbose_name='Название'
@@ -163,6 +194,21 @@ class Shop(models.Model):
         verbose_name='Статус получения заказов',
         default=True
     )
+    feed_etag = models.CharField(
+        verbose_name='ETag прайса',
+        max_length=255,
+        blank=True
+    )
+    feed_last_modified = models.CharField(
+        verbose_name='Last-Modified прайса',
+        max_length=64,
+        blank=True
+    )
+    feed_hash = models.CharField(
+        verbose_name='Хеш содержимого прайса',
+        max_length=64,
+        blank=True
+    )
 
     class Meta:
         verbose_name = 'Магазин'
@@ -173,7 +219,7 @@ class Shop(models.Model):
         return self.name
 
 
-class Category(models.Model):
+class Category(CatalogStats):
     name = models.CharField(
         max_length=40,
         verbose_name='Название'
@@ -242,22 +288,221 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(
         verbose_name='Количество'
     )
+    reserved = models.PositiveIntegerField(
+        verbose_name='Зарезервировано',
+        default=0
+    )
     price = models.PositiveIntegerField(
         verbose_name='Цена'
     )
     price_rrc = models.PositiveIntegerField(
         verbose_name='Рекомендуемая розничная цена'
     )
+    is_active = models.BooleanField(
+        verbose_name='Есть в прайсе',
+        default=True
+    )
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = "Информационный список о продуктах"
         constraints = [
             models.UniqueConstraint(
-                fields=['product', 'shop', 'external_id'],
+                fields=['shop', 'external_id'],
                 name='unique_product_info'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['shop', 'price'],
+                name='product_info_shop_price_idx'
+            ),
+            models.Index(
+                fields=['product', 'price'],
+                name='product_info_product_price_idx'
+            ),
+        ]
+
+    @property
+    def available(self):
+        """
+        Количество, доступное для заказа: остаток из прайса за вычетом резерва
+        """
+        return max(self.quantity - self.reserved, 0)
+
+
+class CatalogEntry(models.Model):
+    """
+    Денормализованная строка каталога для чтения: одна строка на ProductInfo
+    с названиями магазина, продукта, категории и параметрами в JSON
+    """
+    product_info = models.OneToOneField(
+        ProductInfo,
+        verbose_name='Информация о продукте',
+        related_name='catalog_entry',
+        primary_key=True,
+        on_delete=models.CASCADE
+    )
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name='Магазин',
+        related_name='catalog_entries',
+        on_delete=models.CASCADE
+    )
+    shop_name = models.CharField(
+        max_length=50,
+        verbose_name='Название магазина'
+    )
+    shop_state = models.BooleanField(
+        verbose_name='Статус получения заказов',
+        default=True
+    )
+    category = models.ForeignKey(
+        Category,
+        verbose_name='Категория',
+        related_name='catalog_entries',
+        on_delete=models.CASCADE
+    )
+    category_name = models.CharField(
+        max_length=40,
+        verbose_name='Название категории'
+    )
+    product_name = models.CharField(
+        max_length=80,
+        verbose_name='Название продукта'
+    )
+    model = models.CharField(
+        max_length=80,
+        verbose_name='Модель',
+        blank=True
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name='Доступное количество'
+    )
+    price = models.PositiveIntegerField(
+        verbose_name='Цена'
+    )
+    price_rrc = models.PositiveIntegerField(
+        verbose_name='Рекомендуемая розничная цена'
+    )
+    is_active = models.BooleanField(
+        verbose_name='Есть в прайсе',
+        default=True
+    )
+    parameters = models.JSONField(
+        verbose_name='Параметры',
+        default=list
+    )
+    search_text = models.TextField(
+        verbose_name='Текст для поиска',
+        blank=True
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Строка каталога'
+        verbose_name_plural = "Каталог для чтения"
+        indexes = [
+            GinIndex(
+                fields=['search_vector'],
+                name='catalog_search_idx'
+            ),
+            GinIndex(
+                fields=['search_text'],
+                name='catalog_trigram_idx',
+                opclasses=['gin_trgm_ops']
+            ),
+            models.Index(
+                fields=['product_info'],
+                name='catalog_visible_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['shop', 'product_info'],
+                name='catalog_shop_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['category', 'product_info'],
+                name='catalog_category_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['price', 'product_info'],
+                name='catalog_price_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['quantity', 'product_info'],
+                name='catalog_quantity_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['shop', 'price', 'product_info'],
+                name='catalog_shop_price_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+            models.Index(
+                fields=['category', 'price', 'product_info'],
+                name='catalog_category_price_idx',
+                condition=models.Q(shop_state=True, is_active=True)
+            ),
+        ]
+
+
+class ParameterFacet(models.Model):
+    """
+    Индекс для фильтрации по параметрам: список ИД видимых строк каталога
+    с данным значением параметра в пределах магазина и категории
+    """
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name='Магазин',
+        related_name='parameter_facets',
+        on_delete=models.CASCADE
+    )
+    category = models.ForeignKey(
+        Category,
+        verbose_name='Категория',
+        related_name='parameter_facets',
+        on_delete=models.CASCADE
+    )
+    parameter = models.CharField(
+        max_length=40,
+        verbose_name='Название параметра'
+    )
+    value = models.CharField(
+        max_length=100,
+        verbose_name='Значение'
+    )
+    product_info_ids = models.JSONField(
+        verbose_name='ИД информации о продуктах',
+        default=list
+    )
+
+    class Meta:
+        verbose_name = 'Значение параметра'
+        verbose_name_plural = "Индекс значений параметров"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['shop', 'category', 'parameter', 'value'],
+                name='unique_parameter_facet'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['parameter', 'value'],
+                name='parameter_facet_value_idx'
+            ),
+            models.Index(
+                fields=['category', 'parameter'],
+                name='parameter_facet_category_idx'
+            ),
+        ]
 
 
 class Parameter(models.Model):
@@ -430,3 +675,108 @@ class OrderItem(models.Model):
                 name='unique_order_item'
             ),
         ]
+
+
+IMPORT_STATUS_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
+IMPORT_ACTIVE_STATUSES = ('queued', 'running')
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='import_jobs',
+        on_delete=models.CASCADE
+    )
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name='Магазин',
+        related_name='import_jobs',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    url = models.URLField(
+        verbose_name='Ссылка',
+        null=True,
+        blank=True
+    )
+    upload = models.CharField(
+        verbose_name='Файл загруженного прайса',
+        max_length=255,
+        blank=True
+    )
+    feed = models.JSONField(
+        verbose_name='Сведения о загруженном прайсе',
+        default=dict,
+        blank=True
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        choices=IMPORT_STATUS_CHOICES,
+        max_length=15,
+        default='queued'
+    )
+    phase = models.CharField(
+        verbose_name='Этап',
+        max_length=20,
+        blank=True
+    )
+    rows_processed = models.PositiveIntegerField(
+        verbose_name='Обработано записей',
+        default=0
+    )
+    errors = models.JSONField(
+        verbose_name='Ошибки',
+        default=list,
+        blank=True
+    )
+    stats = models.JSONField(
+        verbose_name='Статистика',
+        default=dict,
+        blank=True
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Задача импорта'
+        verbose_name_plural = "Список задач импорта"
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status__in=IMPORT_ACTIVE_STATUSES),
+                name='unique_active_import_job'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.status}'
+
+    @property
+    def skipped(self):
+        return bool(self.stats.get('skipped'))
+
+    @property
+    def rows_per_second(self):
+        if not self.started_at:
+            return 0
+        finished_at = self.finished_at or timezone.now()
+        seconds = (finished_at - self.started_at).total_seconds()
+        return round(self.rows_processed / seconds, 1) if seconds > 0 else 0
@@ -0,0 +1,172 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_right
+from json import dumps as dump_json, loads as load_json
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу сортировки. Курсор хранит значения ключа
+    последней строки страницы, поэтому любая страница выбирается одним
+    индексным диапазоном без OFFSET. Ключ должен быть уникальным,
+    поэтому последним полем сортировки всегда идет id.
+    """
+
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 500
+    ordering = ('id',)
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate(lambda position, limit: self.fetch_queryset(queryset, position, limit), request, view)
+
+    def paginate_queryset_ids(self, queryset, ids, chunk_size, request, view=None):
+        """
+        Страница queryset, ограниченного множеством ИД ids. ИД передаются
+        в SQL частями по chunk_size, поэтому размер запроса не растет вместе
+        с множеством. При сортировке по id части перебираются по порядку,
+        пока страница не заполнится, иначе из каждой части выбирается начало
+        страницы и результаты объединяются. В PostgreSQL каталог вместо этого
+        фильтруется подзапросом к индексу значений параметров (facet_filter).
+        """
+        ids = sorted(ids)
+
+        def fetch(position, limit):
+            rows = []
+            if self.ordering in (('pk',), ('id',)):
+                start = bisect_right(ids, position[0]) if position and isinstance(position[0], int) else 0
+                for offset in range(start, len(ids), chunk_size):
+                    chunk = queryset.filter(pk__in=ids[offset:offset + chunk_size])
+                    rows += self.fetch_queryset(chunk, position, limit - len(rows))
+                    if len(rows) >= limit:
+                        break
+                return rows
+            for offset in range(0, len(ids), chunk_size):
+                rows += self.fetch_queryset(queryset.filter(pk__in=ids[offset:offset + chunk_size]), position, limit)
+            return self.sort_rows(rows)[:limit]
+
+        return self.paginate(fetch, request, view)
+
+    def fetch_queryset(self, queryset, position, limit):
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_position_filter(position))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return list(queryset.order_by(*self.ordering)[:limit])
+
+    def paginate(self, fetch, request, view=None):
+        """
+        Страница из произвольного источника: fetch(position, limit) возвращает
+        до limit строк после позиции курсора (None - с начала) в порядке ordering
+        """
+        self.request = request
+        self.ordering = tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+        self.limit = self.get_limit(request)
+        rows = fetch(self.decode_cursor(request), self.limit + 1)
+        self.next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.next_cursor = self.encode_cursor(self.get_position(rows[-1]))
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_position(self, row):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            values.append(row[name] if isinstance(row, dict) else getattr(row, name))
+        return values
+
+    def sort_rows(self, rows):
+        """
+        Сортировка уже выбранных строк в порядке ordering
+        """
+        for field in reversed(self.ordering):
+            name = field.lstrip('-')
+            rows.sort(key=lambda row: row[name] if isinstance(row, dict) else getattr(row, name),
+                      reverse=field.startswith('-'))
+        return rows
+
+    def get_position_filter(self, position):
+        """
+        Условие «строка после позиции» для составного ключа с учетом направления сортировки
+        """
+        query = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            query |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return query
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(dump_json(position).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = load_json(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering) or \
+                not all(isinstance(value, (int, float, str)) and not isinstance(value, bool) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор следующей страницы',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.limit_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Количество записей на странице',
+                'schema': {'type': 'integer'},
+            },
+        ]
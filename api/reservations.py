@@ -0,0 +1,177 @@
+"""
+Резервирование остатков при оформлении заказа и их возврат при отмене.
+Резерв товара - сумма позиций его открытых заказов (статусы new,
+confirmed, assembled). Он хранится в ProductInfo.reserved отдельно от
+остатка из прайса и пересчитывается по заказам при каждом изменении,
+поэтому импорт, перезаписывающий quantity, не теряет резервы, а
+отправленные заказы перестают держать резерв. В наличии
+quantity - reserved, это значение записывается в строки каталога.
+Строки ProductInfo блокируются через select_for_update в порядке ИД,
+поэтому встречные заказы с общими товарами не взаимоблокируются, а
+блокировки держатся только на время короткой транзакции. Резервы и
+строки каталога меняются одним запросом UPDATE с CASE по товарам.
+"""
+from django.db import transaction
+from django.db.models import Case, PositiveIntegerField, Sum, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .cache import bump_catalog_versions
+from .catalog import refresh_stats
+from .models import CatalogEntry, Order, OrderItem, ProductInfo
+
+CANCELABLE_STATUSES = ('new', 'confirmed', 'assembled')
+CONSUMED_STATUSES = ('sent', 'delivered')
+
+
+class InsufficientStock(ValueError):
+    """
+    Недостаточно товара для заказа. items - список позиций
+    {'product_info': ИД, 'quantity': заказано, 'available': в наличии}
+    """
+
+    def __init__(self, items):
+        super().__init__('Недостаточно товара на складе')
+        self.items = items
+
+
+def _reserved(product_info_ids):
+    """
+    Резерв товаров по открытым заказам: {ИД: количество}
+    """
+    return dict(
+        OrderItem.objects.filter(
+            product_info_id__in=product_info_ids, order__status__in=CANCELABLE_STATUSES
+        ).order_by().values('product_info_id').annotate(total=Sum('quantity')).values_list('product_info_id', 'total')
+    )
+
+
+def _lock_stock(product_info_ids):
+    """
+    Блокировка товаров. Возвращает {ИД: (остаток из прайса, резерв, можно ли заказать)}.
+    Заказать нельзя товар, выбывший из прайса, и товар выключенного магазина.
+    """
+    rows = {
+        product_info_id: (quantity, is_active and shop_state)
+        for product_info_id, quantity, is_active, shop_state in ProductInfo.objects.select_for_update(
+            of=('self',)
+        ).filter(id__in=product_info_ids).order_by('id').values_list('id', 'quantity', 'is_active', 'shop__state')
+    }
+    reserved = _reserved(rows)
+    return {product_info_id: (quantity, reserved.get(product_info_id, 0), orderable)
+            for product_info_id, (quantity, orderable) in rows.items()}
+
+
+def _remaining(stock, product_info_id):
+    quantity, reserved, _ = stock[product_info_id]
+    return max(quantity - reserved, 0)
+
+
+def _available(stock, product_info_id):
+    """
+    Количество, доступное для заказа. 0 для отсутствующих и недоступных товаров.
+    """
+    if product_info_id not in stock or not stock[product_info_id][2]:
+        return 0
+    return _remaining(stock, product_info_id)
+
+
+def _store_reserved(stock):
+    """
+    Пересчет резерва заблокированных товаров по открытым заказам и запись
+    нового доступного количества в строки каталога. Возвращает новые остатки
+    в том же виде, что и _lock_stock.
+    """
+    reserved = _reserved(stock)
+    stock = {product_info_id: (quantity, reserved.get(product_info_id, 0), orderable)
+             for product_info_id, (quantity, _, orderable) in stock.items()}
+
+    def case(values):
+        return Case(
+            *(When(pk=product_info_id, then=Value(value)) for product_info_id, value in values.items()),
+            output_field=PositiveIntegerField()
+        )
+
+    ProductInfo.objects.filter(id__in=stock).update(reserved=case({key: value[1] for key, value in stock.items()}))
+    CatalogEntry.objects.filter(pk__in=stock).update(quantity=case({key: _remaining(stock, key) for key in stock}))
+    return stock
+
+
+def _crossed_zero(before, after):
+    return any((_available(before, key) == 0) != (_available(after, key) == 0) for key in after)
+
+
+def _refresh_catalog(product_info_ids, crossed_zero):
+    """
+    Сброс кеша каталога магазинов заказа. Показатели наличия пересчитываются,
+    только если какой-то товар закончился или снова появился. Снимок каталога
+    остается действительным: остатки в него не входят.
+    """
+    shop_ids = set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('shop_id', flat=True))
+    if crossed_zero:
+        refresh_stats(shop_ids)
+    bump_catalog_versions(shop_ids, categories=crossed_zero, shops=crossed_zero)
+
+
+def reserve_order(order_id, user_id, contact_id):
+    """
+    Оформление корзины пользователя: все товары резервируются
+    в заказанном количестве, корзина получает статус new.
+    Если какого-то товара не хватает, ничего не меняется и вызывается
+    InsufficientStock со всеми такими позициями.
+    Возвращает False, если корзина не найдена.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id, user_id=user_id, status='cart').first()
+        if order is None:
+            return False
+        quantities = dict(OrderItem.objects.filter(order_id=order.id).values_list('product_info_id', 'quantity'))
+        stock = _lock_stock(quantities)
+        short = [
+            {'product_info': product_info_id, 'quantity': quantity, 'available': _available(stock, product_info_id)}
+            for product_info_id, quantity in sorted(quantities.items()) if _available(stock, product_info_id) < quantity
+        ]
+        if short:
+            raise InsufficientStock(short)
+        order.contact_id = contact_id
+        order.status = 'new'
+        order.save(update_fields=['contact', 'status'])
+        changed = _store_reserved(stock)
+    if changed:
+        _refresh_catalog(changed, _crossed_zero(stock, changed))
+    return True
+
+
+def release_order(order_id, user_id):
+    """
+    Отмена заказа пользователя с возвратом зарезервированных остатков.
+    Возвращает False, если заказа нет или его уже нельзя отменить.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(
+            id=order_id, user_id=user_id, status__in=CANCELABLE_STATUSES
+        ).first()
+        if order is None:
+            return False
+        stock = _lock_stock(OrderItem.objects.filter(order_id=order.id).values_list('product_info_id', flat=True))
+        order.status = 'canceled'
+        order.save(update_fields=['status'])
+        changed = _store_reserved(stock)
+    if changed:
+        _refresh_catalog(changed, _crossed_zero(stock, changed))
+    return True
+
+
+@receiver(post_save, sender=Order)
+def consume_order(sender, instance, **kwargs):
+    """
+    Снятие резерва заказа, переведенного в статус sent или delivered:
+    отгруженные единицы уходят из остатка следующим прайсом поставщика,
+    поэтому резерв на них больше не держится.
+    """
+    if instance.status not in CONSUMED_STATUSES:
+        return
+    with transaction.atomic():
+        stock = _lock_stock(OrderItem.objects.filter(order_id=instance.id).values_list('product_info_id', flat=True))
+        changed = _store_reserved(stock)
+    if changed and stock != changed:
+        transaction.on_commit(lambda: _refresh_catalog(changed, _crossed_zero(stock, changed)))
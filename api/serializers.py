@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
+from .models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, \
+    ImportJob, CatalogEntry
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -21,18 +22,21 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+CATALOG_STATS_FIELDS = ('product_count', 'in_stock_count', 'price_min', 'price_max',)
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ('id', 'name',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name',) + CATALOG_STATS_FIELDS
+        read_only_fields = ('id',) + CATALOG_STATS_FIELDS
 
 
 class ShopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shop
-        fields = ('id', 'name', 'state',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'state',) + CATALOG_STATS_FIELDS
+        read_only_fields = ('id',) + CATALOG_STATS_FIELDS
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -53,6 +57,7 @@ class ProductParameterSerializer(serializers.ModelSerializer):
 
 class ProductInfoSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
+    quantity = serializers.IntegerField(source='available', read_only=True)
     product_parameters = ProductParameterSerializer(read_only=True, many=True)
 
     class Meta:
@@ -61,6 +66,21 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class CatalogEntrySerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='pk', read_only=True)
+    product = serializers.SerializerMethodField()
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    product_parameters = serializers.JSONField(source='parameters', read_only=True)
+
+    class Meta:
+        model = CatalogEntry
+        fields = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters',)
+        read_only_fields = fields
+
+    def get_product(self, obj):
+        return {'name': obj.product_name, 'category': obj.category_name}
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
@@ -85,3 +105,14 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ('id', 'ordered_items', 'status', 'dt', 'total_sum', 'contact',)
         read_only_fields = ('id',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_per_second = serializers.FloatField(read_only=True)
+    skipped = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'status', 'phase', 'skipped', 'rows_processed', 'rows_per_second', 'errors', 'stats',
+                  'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
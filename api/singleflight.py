@@ -0,0 +1,74 @@
+"""
+Объединение одновременных вычислений одного ключа (single flight).
+Пока один поток вычисляет результат, остальные потоки процесса с тем же
+ключом ждут и получают его результат или его исключение.
+Если переданы кеш и функция чтения результата из него, вычисление
+дополнительно защищается блокировкой в кеше, общей для всех процессов:
+процесс, не получивший блокировку, ждет появления результата в кеше.
+"""
+import threading
+import time
+from django.conf import settings
+
+_flights = {}
+_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, compute, load=None, cache=None):
+    """
+    Результат compute() для ключа key, вычисляемый не более одного раза
+    одновременно. load() возвращает уже сохраненный в cache результат
+    или None и используется для ожидания вычисления в другом процессе.
+    """
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = _compute_locked(key, compute, load, cache)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _compute_locked(key, compute, load, cache):
+    """
+    Вычисление под блокировкой в кеше. Если блокировку держит другой процесс,
+    результат ждется в кеше не дольше SINGLE_FLIGHT_LOCK_TIMEOUT; если он так
+    и не появился, например процесс завершился, результат вычисляется здесь.
+    """
+    timeout = settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+    if cache is None or load is None or not timeout:
+        return compute()
+    lock_key = f'single-flight:{key}'
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, 1, timeout):
+        result = load()
+        if result is not None:
+            return result
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+    try:
+        result = load()
+        return compute() if result is None else result
+    finally:
+        cache.delete(lock_key)
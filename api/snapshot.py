@@ -0,0 +1,211 @@
+"""
+Снимок видимого каталога в компактном файле для чтения через mmap.
+Все процессы отображают один и тот же файл, поэтому каталог хранится
+в страничном кеше ОС в одном экземпляре, а не в куче каждого процесса.
+
+Формат: сигнатура, длина заголовка (uint32), заголовок JSON с версией
+снимка, числом строк и смещениями секций, затем секции, выровненные
+по 8 байт. Столбцы - массивы фиксированной ширины в порядке ИД строки,
+строки хранятся один раз в таблице строк и адресуются номером.
+Индексы по магазину и категории - номера строк, отсортированные по
+(ключ, ИД), и массив ключей в том же порядке для двоичного поиска.
+
+Остатки в снимок не входят: они меняются с каждым заказом, поэтому
+для строк страницы выбираются из базы по ИД. Версия снимка - отдельный
+счетчик 'snapshot' в общем кеше версий. Его увеличивают только изменения
+состава и описаний строк каталога, и каждое такое изменение сопровождается
+пересборкой, поэтому снимок, собранный любым процессом, действителен во
+всех процессах до следующего изменения.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from json import dumps as dump_json, loads as load_json
+from django.conf import settings
+from .cache import get_versions
+from .models import CatalogEntry
+
+
+MAGIC = b'CATSNAP1'
+INTEGER_COLUMNS = ('id', 'shop_id', 'category_id', 'price', 'price_rrc')
+STRING_COLUMNS = ('model', 'product_name', 'category_name', 'parameters')
+INDEXES = ('shop_id', 'category_id')
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class CatalogSnapshot:
+    """
+    Открытый только для чтения снимок каталога
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self.mmap)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Неверный формат снимка каталога')
+        header_size, = struct.unpack_from('<I', buffer, len(MAGIC))
+        header = load_json(bytes(buffer[len(MAGIC) + 4:len(MAGIC) + 4 + header_size]))
+        self.version = header['version']
+        self.count = header['count']
+        self.sections = {
+            name: buffer[offset:offset + size].cast(typecode) if typecode != 'B' else buffer[offset:offset + size]
+            for name, (offset, size, typecode) in header['sections'].items()
+        }
+
+    def string(self, number):
+        offsets = self.sections['string_offsets']
+        return str(self.sections['strings'][offsets[number]:offsets[number + 1]], 'utf-8')
+
+    def row(self, position):
+        """
+        Строка каталога в виде словаря с ключами CatalogEntry.values()
+        без остатка quantity
+        """
+        sections, string = self.sections, self.string
+        return {
+            'pk': sections['id'][position],
+            'model': string(sections['model'][position]),
+            'product_name': string(sections['product_name'][position]),
+            'category_name': string(sections['category_name'][position]),
+            'shop_id': sections['shop_id'][position],
+            'price': sections['price'][position],
+            'price_rrc': sections['price_rrc'][position],
+            'parameters': load_json(string(sections['parameters'][position])),
+        }
+
+    def _range(self, column, value):
+        keys = self.sections[f'{column}_keys']
+        return bisect_left(keys, value), bisect_right(keys, value)
+
+    def select(self, shop_id=None, category_id=None, after=None, limit=40):
+        """
+        До limit строк с ИД больше after, отобранных по магазину и категории,
+        в порядке ИД. Используется более узкий из индексов, второе условие
+        проверяется по столбцу.
+        """
+        start = 0 if after is None else bisect_right(self.sections['id'], after)
+        filters = {column: value for column, value in (('shop_id', shop_id), ('category_id', category_id))
+                   if value is not None}
+        if not filters:
+            return [self.row(position) for position in range(start, min(start + limit, self.count))]
+        ranges = {column: self._range(column, value) for column, value in filters.items()}
+        column = min(ranges, key=lambda name: ranges[name][1] - ranges[name][0])
+        low, high = ranges[column]
+        index = self.sections[f'{column}_index'][low:high]
+        rows = []
+        for position in index[bisect_left(index, start):]:
+            if all(self.sections[name][position] == value for name, value in filters.items()):
+                rows.append(self.row(position))
+                if len(rows) >= limit:
+                    break
+        return rows
+
+
+def build_snapshot(path, chunk_size=2000):
+    """
+    Сборка снимка видимого каталога. Файл пишется рядом с текущим
+    и подменяет его атомарно, поэтому читатели видят либо старый, либо
+    новый снимок целиком. Возвращает количество строк.
+    """
+    version = get_versions('snapshot')[0][0]
+    columns = {name: array('q') for name in INTEGER_COLUMNS}
+    columns.update({name: array('I') for name in STRING_COLUMNS})
+    strings = {}
+    for row in CatalogEntry.objects.filter(shop_state=True, is_active=True).order_by('pk').values_list(
+            'pk', 'shop_id', 'category_id', 'price', 'price_rrc',
+            'model', 'product_name', 'category_name', 'parameters'
+    ).iterator(chunk_size=chunk_size):
+        for name, value in zip(INTEGER_COLUMNS, row[:len(INTEGER_COLUMNS)]):
+            columns[name].append(value)
+        for name, value in zip(STRING_COLUMNS, row[len(INTEGER_COLUMNS):]):
+            if name == 'parameters':
+                value = dump_json(value, ensure_ascii=False)
+            columns[name].append(strings.setdefault(value, len(strings)))
+    count = len(columns['id'])
+    sections = dict(columns)
+    for column in INDEXES:
+        order = sorted(range(count), key=lambda position: (columns[column][position], position))
+        sections[f'{column}_index'] = array('I', order)
+        sections[f'{column}_keys'] = array('q', (columns[column][position] for position in order))
+    encoded = [value.encode() for value in strings]
+    offsets = array('Q', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections['string_offsets'] = offsets
+    sections['strings'] = b''.join(encoded)
+
+    layout, offset = {}, 0
+    for name, data in sections.items():
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout[name] = [offset, size, data.typecode if isinstance(data, array) else 'B']
+        offset += size + (-size % 8)
+    base = 0
+    while True:
+        header = dump_json({
+            'version': version,
+            'count': count,
+            'sections': {name: [offset + base, size, typecode] for name, (offset, size, typecode) in layout.items()},
+        }).encode()
+        size = len(MAGIC) + 4 + len(header)
+        if size <= base:
+            break
+        base = size + (-size % 8)
+    header += b' ' * (base - len(MAGIC) - 4 - len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for name, data in sections.items():
+                payload = data.tobytes() if isinstance(data, array) else data
+                file.write(payload + b'\0' * (-len(payload) % 8))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return count
+
+
+def get_snapshot():
+    """
+    Снимок каталога текущего процесса. Файл переоткрывается, если его
+    подменили. None, если снимки выключены, файла нет или он собран
+    для устаревшей версии.
+    """
+    global _snapshot
+    path = settings.CATALOG_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None or (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                snapshot = _snapshot = CatalogSnapshot(path)
+            except (OSError, ValueError):
+                return None
+    if snapshot.version != get_versions('snapshot')[0][0]:
+        return None
+    return snapshot
+
+
+def rebuild_snapshot():
+    """
+    Пересборка снимка по пути CATALOG_SNAPSHOT_PATH, если снимки включены
+    """
+    if settings.CATALOG_SNAPSHOT_PATH:
+        return build_snapshot(settings.CATALOG_SNAPSHOT_PATH, settings.CATALOG_EXPORT_CHUNK_SIZE)
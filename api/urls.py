@@ -1,7 +1,7 @@
 from django.urls import path, include
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
-from .views import PartnerUpdateViewSet, PartnerStateViewSet, PartnerOrdersViewSet, SignUpViewSet, \
-    EmailConfirmViewSet, AccountDetailsViewSet, ContactViewSet, SignInViewSet, CategoryViewSet, \
+from .views import PartnerUpdateViewSet, PartnerUploadViewSet, PartnerStateViewSet, PartnerOrdersViewSet, \
+    SignUpViewSet, EmailConfirmViewSet, AccountDetailsViewSet, ContactViewSet, SignInViewSet, CategoryViewSet, \
     ShopViewSet, ProductInfoViewSet, CartViewSet, OrderViewSet
 from rest_framework.routers import DefaultRouter
 
@@ -17,6 +17,7 @@ router_user.register('order', OrderViewSet, basename='order')
 
 router_partner = DefaultRouter()
 router_partner.register('update', PartnerUpdateViewSet, basename='partner-update')
+router_partner.register('upload', PartnerUploadViewSet, basename='partner-upload')
 router_partner.register('state', PartnerStateViewSet, basename='partner-state')
 router_partner.register('orders', PartnerOrdersViewSet, basename='partner-orders')
 
@@ -1,25 +1,91 @@
-import requests
+import re
 from distutils.util import strtobool
-from django.db import IntegrityError
-from django.db.models import Sum, F, Q
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum, F, Q, Case, When, Value, PositiveIntegerField
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator, EmailValidator
 from django.core.mail import EmailMultiAlternatives
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.password_validation import validate_password
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from rest_framework import viewsets, status, mixins
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
-from yaml import load as load_yaml, Loader
 from json import loads as load_json
-from .models import Shop, Category, ProductInfo, Product, Parameter, \
-    ProductParameter, Order, ConfirmEmailToken, User, Contact, OrderItem
+from .cache import cache_response, bump_catalog_versions
+from .catalog import refresh_shop_entries, refresh_category_entries, search_catalog, load_facets, \
+    filter_facets, facet_filter, count_facets, refresh_stats, get_shop_category_ids
+from .export import iter_catalog_export, gzip_stream
+from .fast_serializers import PRODUCT_INFO_FIELDS, EXPANDABLE_FIELDS, ORDER_FIELDS, get_fields, \
+    get_catalog_entry_values, serialize_catalog_entries, serialize_orders
+from .feeds import DECOMPRESSION_ERRORS, UnsupportedEncoding, decompress_stream, encoding_from_name, \
+    spool_upload, FeedTooLarge
+from .jobs import submit_job, get_or_create_job, submit_snapshot_rebuild
+from .models import Shop, Category, Order, ConfirmEmailToken, User, Contact, OrderItem, ImportJob, \
+    CatalogEntry, ProductInfo
+from .pagination import KeysetPagination
 from .permissions import IsPartner, IsShopOwner, IsAdminOrReadOnly
+from .renderers import NDJSONRenderer
+from .reservations import InsufficientStock, reserve_order, release_order
 from .serializers import ShopSerializer, OrderSerializer, UserSerializer, \
-    ContactSerializer, CategorySerializer, ProductInfoSerializer, OrderItemSerializer
+    ContactSerializer, CategorySerializer, ImportJobSerializer
+from .singleflight import single_flight
+from .snapshot import get_snapshot
+
+PARAM_FILTER_RE = re.compile(r'^param\[(.+)\]$')
+
+
+def get_order_fields(request):
+    """
+    Поля заказа по параметру fields и поля товаров в позициях по параметру expand
+    """
+    return (
+        get_fields(request.query_params.get('fields'), None, ORDER_FIELDS),
+        get_fields(None, request.query_params.get('expand'), PRODUCT_INFO_FIELDS, EXPANDABLE_FIELDS),
+    )
+
+
+def load_items(items):
+    """
+    Список позиций корзины: в JSON и MessagePack он передается массивом,
+    в форме - строкой JSON
+    """
+    return load_json(items) if isinstance(items, str) else items
+
+
+def get_cart_quantities(items):
+    """
+    Количество по ИД товара для позиций корзины вида
+    [{'product_info': ИД, 'quantity': количество}]. Повторы товара суммируются.
+    """
+    if not isinstance(items, list):
+        raise ValueError('Неверный формат запроса')
+    quantities = {}
+    for item in items:
+        try:
+            product_info_id, quantity = int(item['product_info']), int(item['quantity'])
+        except (TypeError, KeyError, ValueError):
+            raise ValueError('Неверный формат запроса')
+        if quantity < 1:
+            raise ValueError('Неверное количество товара')
+        quantities[product_info_id] = quantities.get(product_info_id, 0) + quantity
+    return quantities
+
+
+def with_total_sum(orders, fields=ORDER_FIELDS):
+    """
+    Аннотация суммы заказа, если она выводится
+    """
+    if 'total_sum' not in fields:
+        return orders
+    return orders.annotate(total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price')))
 
 
 class SignUpViewSet(viewsets.GenericViewSet):
@@ -134,12 +200,13 @@ class SignInViewSet(viewsets.GenericViewSet):
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class PartnerUpdateViewSet(viewsets.GenericViewSet):
+class PartnerUpdateViewSet(viewsets.GenericViewSet, mixins.RetrieveModelMixin):
     """
     Класс для обновления прайса от поставщика
     """
 
     permission_classes = (IsAuthenticated, IsPartner,)
+    serializer_class = ImportJobSerializer
     throttle_classes = (UserRateThrottle,)
 
     def create(self, request, *args, **kwargs):
@@ -151,45 +218,85 @@ class PartnerUpdateViewSet(viewsets.GenericViewSet):
             except ValidationError as e:
                 return Response({'Error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             else:
-                stream = requests.get(url).text
-                data = load_yaml(stream, Loader=Loader)
-
-                shop, _ = Shop.objects.get_or_create(
-                    name=data['shop'],
-                    user_id=request.user.id
-                )
-                for category in data['categories']:
-                    category_object, _ = Category.objects.get_or_create(
-                        id=category['id'],
-                        name=category['name']
-                    )
-                    category_object.shops.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(
-                        name=item['name'],
-                        category_id=item['category']
-                    )
-                    product_info = ProductInfo.objects.create(
-                        product_id=product.id,
-                        external_id=item['id'],
-                        model=item['model'],
-                        price=item['price'],
-                        price_rrc=item['price_rrc'],
-                        quantity=item['quantity'],
-                        shop_id=shop.id
-                    )
-                    for name, value in item['parameters'].items():
-                        parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(
-                            product_info_id=product_info.id,
-                            parameter_id=parameter_object.id,
-                            value=value
-                        )
-                return Response(status=status.HTTP_201_CREATED)
+                job, created = get_or_create_job(request.user.id, url)
+                if not created:
+                    return Response({'Errors': 'Импорт прайса уже выполняется', 'id': job.id if job else None},
+                                    status=status.HTTP_409_CONFLICT)
+                submit_job(job)
+                return Response({'Status': True, 'id': job.id}, status=status.HTTP_202_ACCEPTED)
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_queryset(self):
+        return ImportJob.objects.filter(user_id=self.request.user.id)
+
+
+class PartnerUploadViewSet(viewsets.GenericViewSet):
+    """
+    Класс для загрузки прайса поставщика в теле запроса
+    """
+
+    permission_classes = (IsAuthenticated, IsPartner,)
+    throttle_classes = (UserRateThrottle,)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Задача импорта создается до чтения тела запроса, поэтому при уже
+        выполняющемся импорте прайс не принимается и не распаковывается.
+        Принятый прайс сохраняется в файл IMPORT_UPLOAD_DIR, путь к нему
+        записывается в задачу. Если прайс не удалось принять, задача удаляется.
+        """
+        job, created = get_or_create_job(request.user.id)
+        if not created:
+            return Response({'Errors': 'Импорт прайса уже выполняется', 'id': job.id if job else None},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            feed = self.get_feed(request)
+        except BaseException:
+            job.delete()
+            raise
+        if isinstance(feed, Response):
+            job.delete()
+            return feed
+        job.upload = feed.pop('path')
+        job.feed = feed
+        job.save(update_fields=['upload', 'feed'])
+        submit_job(job)
+        return Response({'Status': True, 'id': job.id}, status=status.HTTP_202_ACCEPTED)
+
+    def get_feed(self, request):
+        """
+        Прайс из тела запроса, распакованный в файл IMPORT_UPLOAD_DIR,
+        или ответ с ошибкой
+        """
+        content_type = request.content_type or ''
+        if content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'Errors': 'Не указаны все необходимые аргументы'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            encoding, name = encoding_from_name(upload.name)
+            stream, content_type = upload, upload.content_type
+        else:
+            if request.stream is None:
+                return Response({'Errors': 'Не указаны все необходимые аргументы'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            encoding, name = request.META.get('HTTP_CONTENT_ENCODING'), None
+            stream = request.stream
+        try:
+            path, digest = spool_upload(decompress_stream(stream, encoding), settings.IMPORT_UPLOAD_DIR)
+        except UnsupportedEncoding as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        except FeedTooLarge as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except DECOMPRESSION_ERRORS as e:
+            return Response({'Errors': f'Не удалось распаковать прайс: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return {
+            'path': path,
+            'hash': digest,
+            'name': name,
+            'content_type': content_type,
+        }
+
 
 class PartnerStateViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
     """
@@ -205,6 +312,10 @@ class PartnerStateViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
         if state:
             try:
                 Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                shop_ids = list(Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
+                refresh_shop_entries(shop_ids)
+                bump_catalog_versions(shop_ids, categories=True, shops=True, snapshot=True)
+                submit_snapshot_rebuild()
                 return Response(status=status.HTTP_200_OK)
             except ValueError as e:
                 return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -225,14 +336,27 @@ class PartnerOrdersViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
     serializer_class = OrderSerializer
     throttle_classes = (UserRateThrottle,)
 
-    def get_queryset(self):
+    def get_queryset(self, fields=ORDER_FIELDS):
         orders = Order.objects.filter(
             ordered_items__product_info__shop_id=self.request.user.shop.id
-        ).exclude(status='cart').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        return orders
+        ).exclude(status='cart')
+        return with_total_sum(orders, fields).distinct()
+
+    def list(self, request, *args, **kwargs):
+        try:
+            fields, product_fields = get_order_fields(request)
+        except ValueError as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def compute():
+            queryset = self.filter_queryset(self.get_queryset(fields))
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(serialize_orders(page, fields, product_fields)).data
+            return serialize_orders(queryset, fields, product_fields)
+
+        key = f'partner-orders:{request.user.shop.id}:{request.build_absolute_uri()}'
+        return Response(single_flight(key, compute))
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -245,6 +369,34 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     throttle_classes = (AnonRateThrottle,)
 
+    @cache_response(('categories',))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(('categories',))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save()
+        bump_catalog_versions(categories=True)
+
+    def perform_update(self, serializer):
+        category = serializer.save()
+        refresh_category_entries([category.id])
+        bump_catalog_versions(categories=True, snapshot=True)
+        submit_snapshot_rebuild()
+
+    def perform_destroy(self, instance):
+        shop_ids = set(CatalogEntry.objects.filter(category_id=instance.id).values_list(
+            'shop_id', flat=True
+        ).distinct())
+        shop_ids.update(instance.shops.values_list('id', flat=True))
+        instance.delete()
+        refresh_stats(shop_ids)
+        bump_catalog_versions(shop_ids, categories=True, shops=True, snapshot=True)
+        submit_snapshot_rebuild()
+
 
 class ShopViewSet(viewsets.ModelViewSet):
     """
@@ -256,29 +408,191 @@ class ShopViewSet(viewsets.ModelViewSet):
     serializer_class = ShopSerializer
     throttle_classes = (AnonRateThrottle,)
 
+    @cache_response(('shops',))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(('shops',))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        shop = serializer.save()
+        bump_catalog_versions([shop.id], shops=True)
+
+    def perform_update(self, serializer):
+        shop = serializer.save()
+        refresh_shop_entries([shop.id])
+        bump_catalog_versions([shop.id], categories=True, shops=True, snapshot=True)
+        submit_snapshot_rebuild()
+
+    def perform_destroy(self, instance):
+        shop_id = instance.id
+        category_ids = get_shop_category_ids([shop_id])
+        instance.delete()
+        refresh_stats([], category_ids)
+        bump_catalog_versions([shop_id], categories=True, shops=True, snapshot=True)
+        submit_snapshot_rebuild()
+
 
 class ProductInfoViewSet(viewsets.GenericViewSet):
     """
     Класс для поиска товаров
     """
 
+    pagination_class = KeysetPagination
+    keyset_ordering = ('pk',)
+    ordering_fields = {
+        'price': ('price', 'pk'),
+        '-price': ('-price', '-pk'),
+        'quantity': ('quantity', 'pk'),
+        '-quantity': ('-quantity', '-pk'),
+    }
     throttle_classes = (AnonRateThrottle,)
 
+    def get_cache_versions(self, request):
+        shop_id = request.query_params.get('shop_id')
+        if shop_id:
+            return 'categories', f'shop:{shop_id}'
+        return 'catalog',
+
+    def get_catalog_filter(self, request):
+        """
+        Условие отбора видимых строк каталога по магазину, категории и диапазону цен
+        """
+        query = Q(shop_state=True, is_active=True)
+        shop_id = request.query_params.get('shop_id')
+        category_id = request.query_params.get('category_id')
+        try:
+            if shop_id:
+                query = query & Q(shop_id=int(shop_id))
+            if category_id:
+                query = query & Q(category_id=int(category_id))
+        except ValueError:
+            raise ValueError('Неверный магазин или категория')
+        try:
+            for param, lookup in (('price_min', 'price__gte'), ('price_max', 'price__lte')):
+                if request.query_params.get(param):
+                    query = query & Q(**{lookup: int(request.query_params[param])})
+        except ValueError:
+            raise ValueError('Неверный диапазон цен')
+        return query
+
+    def get_fields(self, request):
+        return get_fields(
+            request.query_params.get('fields'), request.query_params.get('expand'),
+            PRODUCT_INFO_FIELDS, EXPANDABLE_FIELDS
+        )
+
+    def paginate_snapshot(self, request, shop_id, category_id, fields):
+        """
+        Страница каталога из снимка в памяти для запросов без поиска, фильтров
+        по параметрам и ценам и с порядком по умолчанию. Остатки строк страницы
+        выбираются из базы одним запросом по первичному ключу. None, если снимка
+        нет или он устарел: тогда страница выбирается из базы.
+        """
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return None
+        try:
+            shop_id = int(shop_id) if shop_id else None
+            category_id = int(category_id) if category_id else None
+        except ValueError:
+            return None
+
+        def fetch(position, limit):
+            if position is not None and not isinstance(position[0], int):
+                raise NotFound(self.paginator.invalid_cursor_message)
+            rows = snapshot.select(shop_id, category_id, position and position[0], limit)
+            if 'quantity' in fields and rows:
+                quantities = dict(CatalogEntry.objects.filter(
+                    pk__in=[row['pk'] for row in rows]
+                ).values_list('pk', 'quantity'))
+                for row in rows:
+                    row['quantity'] = quantities.get(row['pk'], 0)
+            return rows
+
+        return self.paginator.paginate(fetch, request, self)
+
+    @cache_response(get_cache_versions)
     def list(self, request, *args, **kwargs):
-        query = Q(shop__state=True)
         shop_id = request.query_params.get('shop_id')
         category_id = request.query_params.get('category_id')
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
-        if category_id:
-            query = query & Q(product__category_id=category_id)
-        queryset = ProductInfo.objects.filter(query).select_related(
-            'shop', 'product__category'
-        ).prefetch_related(
-            'product_parameters__parameter'
-        ).distinct()
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data)
+        ordering = request.query_params.get('ordering')
+        if ordering and ordering not in self.ordering_fields:
+            return Response({'Errors': 'Неверный порядок сортировки'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            query = self.get_catalog_filter(request)
+            fields = self.get_fields(request)
+        except ValueError as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = CatalogEntry.objects.filter(query)
+        parameters = {}
+        for key in request.query_params:
+            match = PARAM_FILTER_RE.match(key)
+            if match:
+                parameters[match.group(1)] = request.query_params.getlist(key)
+        try:
+            with_facets = strtobool(request.query_params.get('facets', 'false'))
+        except ValueError as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        text = request.query_params.get('q', '').strip()
+        if not (parameters or with_facets or text or ordering or request.query_params.get('price_min') or
+                request.query_params.get('price_max')):
+            page = self.paginate_snapshot(request, shop_id, category_id, fields)
+            if page is not None:
+                return self.get_paginated_response(serialize_catalog_entries(page, fields))
+        index = load_facets(shop_id, category_id, None if with_facets else list(parameters)) \
+            if parameters or with_facets else {}
+        ids = filter_facets(index, parameters)
+        chunked = ids is not None and len(ids) > settings.CATALOG_ID_CHUNK_SIZE
+        if chunked and connection.vendor == 'postgresql':
+            queryset = queryset.filter(facet_filter(shop_id, category_id, parameters))
+            chunked = False
+        elif ids is not None and not chunked:
+            queryset = queryset.filter(pk__in=ids)
+        if text:
+            queryset = search_catalog(queryset, text)
+            self.keyset_ordering = ('-rank', 'pk')
+        if ordering:
+            self.keyset_ordering = self.ordering_fields[ordering]
+        values = get_catalog_entry_values(fields)
+        ordering_values = {field.lstrip('-') for field in self.keyset_ordering} - set(values)
+        rows = queryset.values(*values, *ordering_values)
+        if chunked:
+            page = self.paginator.paginate_queryset_ids(rows, ids, settings.CATALOG_ID_CHUNK_SIZE, request, self)
+        else:
+            page = self.paginate_queryset(rows)
+        response = self.get_paginated_response(serialize_catalog_entries(page, fields))
+        if with_facets:
+            found = None
+            if text or request.query_params.get('price_min') or request.query_params.get('price_max'):
+                found = queryset.order_by().values_list('pk', flat=True).iterator(settings.CATALOG_ID_CHUNK_SIZE)
+            response.data['facets'] = count_facets(index, ids, found)
+        return response
+
+    @action(detail=False, renderer_classes=(NDJSONRenderer, JSONRenderer))
+    def export(self, request, *args, **kwargs):
+        """
+        Потоковая выгрузка всех видимых строк каталога в формате NDJSON.
+        Если клиент принимает gzip, поток сжимается.
+        """
+        try:
+            query = self.get_catalog_filter(request)
+            fields = self.get_fields(request)
+        except ValueError as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        chunks = iter_catalog_export(CatalogEntry.objects.filter(query), fields, settings.CATALOG_EXPORT_CHUNK_SIZE)
+        filename = 'catalog.ndjson'
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            chunks = gzip_stream(chunks)
+            filename += '.gz'
+        response = StreamingHttpResponse(chunks, content_type=NDJSONRenderer.media_type)
+        if filename.endswith('.gz'):
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
 
 
 class CartViewSet(viewsets.GenericViewSet):
@@ -290,83 +604,122 @@ class CartViewSet(viewsets.GenericViewSet):
     throttle_classes = (UserRateThrottle,)
 
     def list(self, request, *args, **kwargs):
-        cart = Order.objects.filter(
-            user_id=request.user.id, status='cart').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(cart, many=True)
-        return Response(serializer.data)
+        cart = with_total_sum(Order.objects.filter(user_id=request.user.id, status='cart')).distinct()
+        return Response(serialize_orders(cart))
 
     def create(self, request, *args, **kwargs):
+        """
+        Добавление товаров в корзину. Товары проверяются одним запросом,
+        количество уже лежащих в корзине товаров увеличивается, остальные
+        добавляются, все изменения выполняются атомарно.
+        """
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
+                quantities = get_cart_quantities(load_items(items_sting))
             except ValueError as e:
                 return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                cart, _ = Order.objects.get_or_create(
+            missing = set(quantities) - set(ProductInfo.objects.filter(
+                id__in=quantities, is_active=True, shop__state=True
+            ).values_list('id', flat=True))
+            if missing:
+                return Response({'Errors': f'Товары не найдены: {", ".join(map(str, sorted(missing)))}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                cart, _ = Order.objects.select_for_update().get_or_create(
                     user_id=request.user.id,
                     status='cart',
                 )
-                objects_created = 0
-                for order_item in items_dict:
-                    order_item.update({'order': cart.id})
-                    serializer = OrderItemSerializer(data=order_item)
-                    if serializer.is_valid():
-                        try:
-                            serializer.save()
-                        except IntegrityError as error:
-                            return Response({'Errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
-                        else:
-                            objects_created += 1
-                    else:
-                        return Response({'Errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
-                return Response({'Создано объектов': objects_created}, status=status.HTTP_201_CREATED)
+                existing = OrderItem.objects.filter(
+                    order_id=cart.id, product_info_id__in=quantities
+                ).only('id', 'product_info_id', 'quantity')
+                existing = {item.product_info_id: item for item in existing}
+                for product_info_id, item in existing.items():
+                    item.quantity += quantities[product_info_id]
+                OrderItem.objects.bulk_update(existing.values(), ['quantity'])
+                created = OrderItem.objects.bulk_create([
+                    OrderItem(order_id=cart.id, product_info_id=product_info_id, quantity=quantity)
+                    for product_info_id, quantity in quantities.items() if product_info_id not in existing
+                ])
+            return Response({'Создано объектов': len(created), 'Обновлено объектов': len(existing)},
+                            status=status.HTTP_201_CREATED)
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_cart_items(self, request):
+        """
+        Позиции корзины пользователя. Вызывается в транзакции: корзина блокируется
+        до ее конца, поэтому оформление заказа не проходит между выбором позиций
+        и их изменением.
+        """
+        cart_id = Order.objects.select_for_update().filter(
+            user_id=request.user.id, status='cart'
+        ).values_list('id', flat=True).first()
+        return OrderItem.objects.filter(order_id=cart_id)
+
     def delete(self, request, *args, **kwargs):
+        """
+        Удаление позиций корзины одним запросом DELETE по списку ИД.
+        Для каждой позиции возвращается результат.
+        """
         items_sting = request.data.get('items')
         if items_sting:
-            items_list = items_sting.split(',')
-            cart, _ = Order.objects.get_or_create(
-                user_id=request.user.id,
-                status='cart',
-            )
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=cart.id, id=order_item_id)
-                    objects_deleted = True
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
-                return Response({'Удалено объектов': deleted_count}, status=status.HTTP_200_OK)
+            items_list = items_sting.split(',') if isinstance(items_sting, str) else [str(item) for item in items_sting]
+            ids = [int(item) for item in items_list if item.strip().isdigit()]
+            if ids:
+                with transaction.atomic():
+                    cart_items = self.get_cart_items(request)
+                    found = set(cart_items.filter(id__in=ids).values_list('id', flat=True))
+                    deleted_count = cart_items.filter(id__in=found).delete()[0] if found else 0
+                results = []
+                for item in items_list:
+                    if not item.strip().isdigit():
+                        results.append({'id': item, 'Status': False, 'Errors': 'Неверный формат позиции'})
+                    elif int(item) in found:
+                        results.append({'id': int(item), 'Status': True})
+                    else:
+                        results.append({'id': int(item), 'Status': False, 'Errors': 'Позиция не найдена'})
+                return Response({'Удалено объектов': deleted_count, 'Позиции': results}, status=status.HTTP_200_OK)
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
 
     def partial_update(self, request, *args, **kwargs):
+        """
+        Изменение количества товаров в корзине одним запросом UPDATE с CASE.
+        Для каждой позиции возвращается результат.
+        """
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
+                items = load_items(items_sting)
             except ValueError:
-                Response({'Errors': 'Неверный формат запроса'}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                cart, _ = Order.objects.get_or_create(
-                    user_id=request.user.id,
-                    status='cart',
-                )
-                objects_updated = 0
-                for order_item in items_dict:
-                    if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                        objects_updated += OrderItem.objects.filter(
-                            order_id=cart.id,
-                            id=order_item['id'],
-                        ).update(
-                            quantity=order_item['quantity'],
-                        )
-                return Response({'Обновлено объектов': objects_updated}, status=status.HTTP_201_CREATED)
+                return Response({'Errors': 'Неверный формат запроса'}, status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(items, list):
+                return Response({'Errors': 'Неверный формат запроса'}, status=status.HTTP_400_BAD_REQUEST)
+            quantities, results = {}, []
+            for item in items:
+                item_id, quantity = (item.get('id'), item.get('quantity')) if isinstance(item, dict) else (None, None)
+                if type(item_id) != int or type(quantity) != int:
+                    results.append({'id': item_id, 'Status': False, 'Errors': 'Неверный формат позиции'})
+                elif quantity < 1:
+                    results.append({'id': item_id, 'Status': False, 'Errors': 'Неверное количество товара'})
+                else:
+                    quantities[item_id] = quantity
+                    results.append({'id': item_id})
+            objects_updated = 0
+            with transaction.atomic():
+                cart_items = self.get_cart_items(request)
+                found = set(cart_items.filter(id__in=quantities).values_list('id', flat=True))
+                if found:
+                    objects_updated = cart_items.filter(id__in=found).update(quantity=Case(
+                        *(When(id=item_id, then=Value(quantities[item_id])) for item_id in found),
+                        output_field=PositiveIntegerField()
+                    ))
+            for result in results:
+                if 'Status' not in result:
+                    result['Status'] = result['id'] in found
+                    if not result['Status']:
+                        result['Errors'] = 'Позиция не найдена'
+            return Response({'Обновлено объектов': objects_updated, 'Позиции': results},
+                            status=status.HTTP_201_CREATED)
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -379,23 +732,24 @@ class OrderViewSet(viewsets.GenericViewSet):
     throttle_classes = (UserRateThrottle,)
 
     def list(self, request, *args, **kwargs):
-        order = Order.objects.filter(
-            user_id=request.user.id).exclude(status='cart').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        try:
+            fields, product_fields = get_order_fields(request)
+        except ValueError as e:
+            return Response({'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        order = with_total_sum(Order.objects.filter(user_id=request.user.id).exclude(status='cart'), fields).distinct()
+        return Response(serialize_orders(order, fields, product_fields), status=status.HTTP_200_OK)
 
     def create(self, request, *args, **kwargs):
+        """
+        Оформление корзины с резервированием остатков товаров
+        """
         if {'id', 'contact'}.issubset(request.data):
-            if request.data['id'].isdigit():
+            if str(request.data['id']).isdigit():
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        status='new')
-                except IntegrityError as error:
+                    is_updated = reserve_order(int(request.data['id']), request.user.id, request.data['contact'])
+                except InsufficientStock as e:
+                    return Response({'Errors': str(e), 'Позиции': e.items}, status=status.HTTP_409_CONFLICT)
+                except (IntegrityError, ValueError) as error:
                     print(error)
                     return Response({'Errors': 'Неправильно указаны аргументы'}, status=status.HTTP_400_BAD_REQUEST)
                 else:
@@ -409,3 +763,12 @@ class OrderViewSet(viewsets.GenericViewSet):
                         msg.send()
                         return Response(status=status.HTTP_201_CREATED)
         return Response({'Errors': 'Не указаны все необходимые аргументы'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        """
+        Отмена заказа с возвратом зарезервированных остатков
+        """
+        if kwargs['pk'].isdigit() and release_order(int(kwargs['pk']), request.user.id):
+            return Response({'Status': True}, status=status.HTTP_200_OK)
+        return Response({'Errors': 'Заказ не найден или не может быть отменен'}, status=status.HTTP_400_BAD_REQUEST)
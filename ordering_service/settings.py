@@ -1,4 +1,5 @@
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import dotenv_values
 
@@ -26,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_rest_passwordreset',
@@ -126,13 +128,27 @@ EMAIL_USE_SSL = True
 
 SERVER_EMAIL = EMAIL_HOST_USER
 
+CACHES = {
+    'default': {
+        'BACKEND': config.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config.get('CACHE_LOCATION', 'cache_table'),
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'api.renderers.ORJSONRenderer',
+        *(('api.renderers.MessagePackRenderer',) if find_spec('msgpack') else ()),
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.renderers.ORJSONParser',
+        *(('api.renderers.MessagePackParser',) if find_spec('msgpack') else ()),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
@@ -149,6 +165,52 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_JOB_WORKERS = 4
+
+IMPORT_JOB_TIMEOUT = 60 * 60
+
+IMPORT_QUEUE_POLL_INTERVAL = 5
+
+IMPORT_FETCH_TIMEOUT = 60
+
+IMPORT_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+IMPORT_MAX_FEED_SIZE = 512 * 1024 * 1024
+
+IMPORT_UPLOAD_DIR = BASE_DIR / 'import_uploads'
+
+FEED_REFRESH_INTERVAL = 60 * 60
+
+FEED_REFRESH_WORKERS = 4
+
+FEED_REFRESH_PER_HOST = 2
+
+FEED_REFRESH_JITTER = 30
+
+FEED_REFRESH_BACKOFF = 5 * 60
+
+FEED_REFRESH_BACKOFF_MAX = 24 * 60 * 60
+
+CATALOG_SEARCH_CONFIG = 'russian'
+
+CATALOG_SEARCH_MIN_SIMILARITY = 0.3
+
+CATALOG_CACHE = 'default'
+
+CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+
+CATALOG_ID_CHUNK_SIZE = 1000
+
+CATALOG_SNAPSHOT_PATH = None
+
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Ordering service API',
     'DESCRIPTION': 'Order automation for the retail chain. Users of the service are the buyer (the manager of the '
@@ -1,6 +1,27 @@
+import gzip
+import threading
+import time
 import pytest
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
+from model_bakery import baker
+from api.models import ProductInfo, ProductParameter, ImportJob, OrderItem, Category, CatalogEntry
+from api.cache import bump_catalog_versions, bump_versions, get_versions
+from api.catalog import count_facets, facet_filter, load_facets
+from api.checks import check_catalog_cache
+from api.jobs import fetch_feed
+from api.reservations import reserve_order
+from api.serializers import ProductInfoSerializer
+from api.singleflight import single_flight
+from api.snapshot import get_snapshot
 
 
 @pytest.mark.django_db
@@ -12,7 +33,775 @@ def test_shop_update(api_client_partner):
         'url': 'https://raw.githubusercontent.com/netology-code/python-final-diplom/master/data/shop1.yaml'
     })
 
-    assert resp.status_code == status.HTTP_201_CREATED
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert resp.json().get('id')
+
+
+@pytest.mark.django_db
+def test_shop_update_import(api_client_partner, price_list, feed_server):
+    url = reverse('api:partner-update-list')
+    api_client, user = api_client_partner
+    feed_server(price_list(goods=25, parameters=4))
+
+    resp = api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    job = api_client.get(reverse('api:partner-update-detail', args=(resp.json()['id'],))).json()
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert job['status'] == 'done'
+    assert job['rows_processed'] == 28
+    assert job['stats']['goods'] == 25
+    assert ProductInfo.objects.filter(shop__user=user).count() == 25
+    assert ProductParameter.objects.filter(product_info__shop__user=user).count() == 100
+
+
+@pytest.mark.django_db
+def test_shop_update_keeps_reserved(api_client_partner, api_client_auth, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    _, user = api_client_auth
+    data = price_list(goods=3)
+    data['goods'][2]['quantity'] = 10
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    product = ProductInfo.objects.get(external_id=10002)
+    cart = baker.make('api.Order', user=user, status='cart')
+    baker.make('api.OrderItem', order=cart, product_info=product, quantity=4)
+    reserve_order(cart.id, user.id, None)
+
+    data['goods'][2]['quantity'] = 6
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    product.refresh_from_db()
+
+    assert (product.quantity, product.reserved) == (6, 4)
+    assert CatalogEntry.objects.get(pk=product.id).quantity == 2
+
+
+@pytest.mark.django_db
+def test_shop_update_query_count(api_client_partner, price_list, feed_server):
+    url = reverse('api:partner-update-list')
+    api_client, _ = api_client_partner
+
+    feed_server(price_list(goods=10))
+    api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    feed_server(price_list(goods=300))
+    api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    small, large = ImportJob.objects.order_by('id')
+
+    assert large.stats['queries'] <= small.stats['queries'] + 5
+
+
+@pytest.mark.parametrize(
+    'content_type',
+    ('application/x-yaml', 'application/json', 'application/x-ndjson')
+)
+@pytest.mark.django_db
+def test_shop_update_formats(api_client_partner, price_list, feed_server, content_type):
+    url = reverse('api:partner-update-list')
+    api_client, user = api_client_partner
+    feed_server(price_list(goods=15, parameters=2), content_type=content_type)
+
+    resp = api_client.post(url, data={'url': 'https://example.com/shop'})
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert ProductInfo.objects.filter(shop__user=user).count() == 15
+    assert ProductParameter.objects.filter(product_info__shop__user=user).count() == 30
+
+
+@pytest.mark.django_db
+def test_shop_update_string_ids(api_client_partner, price_list, feed_server):
+    url = reverse('api:partner-update-list')
+    api_client, user = api_client_partner
+    data = price_list(goods=5)
+    for item in data['goods']:
+        item['id'] = str(item['id'])
+    feed_server(data, content_type='application/json')
+
+    api_client.post(url, data={'url': 'https://example.com/shop'})
+    data['goods'][0]['price'] += 1
+    feed_server(data, content_type='application/json')
+    resp = api_client.post(url, data={'url': 'https://example.com/shop'})
+    stats = ImportJob.objects.get(id=resp.json()['id']).stats
+
+    assert (stats['created'], stats['updated'], stats['unchanged'], stats['retired']) == (0, 1, 4, 0)
+    assert ProductInfo.objects.filter(shop__user=user, is_active=True).count() == 5
+
+
+@pytest.mark.django_db
+def test_shop_update_diff(api_client_partner, price_list, feed_server):
+    url = reverse('api:partner-update-list')
+    api_client, user = api_client_partner
+    data = price_list(goods=20, parameters=2)
+    feed_server(data)
+    api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+    order = baker.make('api.Order', user=user)
+    ordered = baker.make('api.OrderItem', product_info_id=ids[10019], order=order, quantity=1)
+
+    data['goods'][0]['price'] += 1
+    data['goods'][1]['parameters']['Parameter 0'] = 'new value'
+    data['goods'].pop()
+    data['goods'].append(dict(data['goods'][2], id=20000, model='new'))
+    feed_server(data)
+    resp = api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    stats = ImportJob.objects.get(id=resp.json()['id']).stats
+
+    assert (stats['created'], stats['updated'], stats['unchanged'], stats['retired']) == (1, 2, 17, 1)
+    assert ids == {
+        external_id: product_info_id
+        for external_id, product_info_id in ProductInfo.objects.values_list('external_id', 'id')
+        if external_id != 20000
+    }
+    assert ProductInfo.objects.get(external_id=10000).price == data['goods'][0]['price']
+    assert ProductInfo.objects.filter(is_active=False).get().id == ids[10019]
+    assert OrderItem.objects.filter(id=ordered.id).exists()
+
+
+@pytest.mark.parametrize('etag', (None, '"v1"'))
+@pytest.mark.django_db
+def test_shop_update_unchanged_feed(api_client_partner, price_list, feed_server, etag):
+    url = reverse('api:partner-update-list')
+    api_client, _ = api_client_partner
+    data = price_list(goods=5)
+    feed_server(data, etag=etag)
+
+    first = api_client.post(url, data={'url': 'https://example.com/shop.yaml'}).json()
+    second = api_client.post(url, data={'url': 'https://example.com/shop.yaml'}).json()
+    data['goods'][0]['quantity'] += 1
+    feed_server(data, etag='"v2"' if etag else None)
+    third = api_client.post(url, data={'url': 'https://example.com/shop.yaml'}).json()
+    jobs = [api_client.get(reverse('api:partner-update-detail', args=(job['id'],))).json()
+            for job in (first, second, third)]
+
+    assert [job['skipped'] for job in jobs] == [False, True, False]
+    assert ('304' in jobs[1]['stats']['reason']) == bool(etag)
+    assert jobs[2]['stats']['updated'] == 1
+
+
+@pytest.mark.django_db
+def test_catalog_follows_import(api_client_partner, api_client, price_list, feed_server):
+    url = reverse('api:partner-update-list')
+    partner_client, _ = api_client_partner
+    data = price_list(goods=8, parameters=2)
+    feed_server(data)
+    partner_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    data['goods'][0]['price'] += 5
+    data['goods'][1]['parameters']['Parameter 1'] = 'changed'
+    data['goods'].pop()
+    feed_server(data)
+    partner_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    expected = ProductInfoSerializer(
+        ProductInfo.objects.filter(is_active=True).order_by('id').prefetch_related('product_parameters__parameter'),
+        many=True
+    ).data
+
+    resp = api_client.get(reverse('api:products-list'))
+
+    assert resp.json()['results'] == expected
+    assert len(expected) == 7
+
+
+@pytest.mark.django_db
+def test_catalog_follows_state(api_client_partner, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=4))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+    hidden = api_client.get(reverse('api:products-list')).json()
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'true'})
+    shown = api_client.get(reverse('api:products-list')).json()
+
+    assert len(hidden['results']) == 0
+    assert len(shown['results']) == 4
+
+
+@pytest.mark.django_db
+def test_catalog_parameter_facets(api_client_partner, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    data = price_list(goods=21, parameters=2)
+    data['goods'][0]['parameters']['Parameter 1'] = 'special'
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    url = reverse('api:products-list')
+    external_ids = dict(ProductInfo.objects.values_list('id', 'external_id'))
+
+    single = api_client.get(url, {'param[Parameter 0]': 'value 0', 'facets': 'true'}).json()
+    both = api_client.get(url, {'param[Parameter 0]': 'value 0', 'param[Parameter 1]': 'value 0'}).json()
+    either = api_client.get(url, {'param[Parameter 0]': ['value 0', 'value 1']}).json()
+    unknown = api_client.get(url, {'param[Unknown]': 'value 0'}).json()
+
+    assert [external_ids[item['id']] for item in single['results']] == [10000, 10007, 10014]
+    assert single['facets'] == {
+        'Parameter 0': {'value 0': 3},
+        'Parameter 1': {'special': 1, 'value 0': 2},
+    }
+    assert [external_ids[item['id']] for item in both['results']] == [10007, 10014]
+    assert 'facets' not in both
+    assert len(either['results']) == 6
+    assert unknown['results'] == []
+
+
+@pytest.mark.parametrize('params', (
+    {'param[Parameter 0]': ['value 0', 'value 1', 'value 2']},
+    {'param[Parameter 0]': ['value 0', 'value 1', 'value 2'], 'ordering': '-price'},
+    {'param[Parameter 0]': ['value 0', 'value 1', 'value 2'], 'ordering': 'quantity', 'facets': 'true'},
+    {'param[Parameter 0]': ['value 0', 'value 1', 'value 2'], 'q': 'product', 'facets': 'true'},
+))
+@pytest.mark.django_db
+def test_catalog_parameter_facets_chunked(api_client_partner, api_client, price_list, feed_server, settings, params):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=21, parameters=2))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    results = []
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        statements[-1].append(len(params or ()))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        for chunk_size, nocache in ((1000, 1), (2, 2)):
+            settings.CATALOG_ID_CHUNK_SIZE = chunk_size
+            statements.append([])
+            pages = get_catalog_pages(api_client, {**params, 'nocache': nocache})
+            facets = api_client.get(reverse('api:products-list'), {**params, 'nocache': nocache}).json().get('facets')
+            results.append((pages, facets))
+    (whole, whole_facets), (chunked, chunked_facets) = results
+
+    assert sum(len(page) for page in whole) == 9
+    assert chunked == whole
+    assert chunked_facets == whole_facets
+    assert max(statements[1]) < max(statements[0])
+
+
+@pytest.mark.django_db
+def test_catalog_facets_price_range(api_client_partner, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=14, parameters=1))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    url = reverse('api:products-list')
+
+    priced = api_client.get(url, {'price_min': 105, 'price_max': 108, 'facets': 'true'}).json()
+    filtered = api_client.get(url, {'param[Parameter 0]': ['value 0', 'value 6'], 'price_min': 107,
+                                    'facets': 'true'}).json()
+
+    assert len(priced['results']) == 4
+    assert priced['facets'] == {'Parameter 0': {'value 0': 1, 'value 5': 1, 'value 6': 1, 'value 1': 1}}
+    assert len(filtered['results']) == 2
+    assert filtered['facets'] == {'Parameter 0': {'value 0': 1, 'value 6': 1}}
+
+
+@pytest.mark.django_db
+def test_load_facets_parameters(api_client_partner, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=7, parameters=3))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+
+    assert list(load_facets(parameters=['Parameter 1'])) == ['Parameter 1']
+    assert sorted(load_facets()) == ['Parameter 0', 'Parameter 1', 'Parameter 2']
+
+
+def test_count_facets_found():
+    index = {'Color': {'red': {1, 2, 3}, 'blue': {4, 5}}, 'Size': {'S': {1, 4}, 'M': {2, 3, 5}}}
+
+    assert count_facets(index, None, iter([1, 2, 4])) == count_facets(index, {1, 2, 4})
+    assert count_facets(index, {1, 2, 3, 5}, iter([1, 2, 4, 5])) == {
+        'Color': {'blue': 1, 'red': 2}, 'Size': {'M': 2, 'S': 1}
+    }
+    assert count_facets(index, None, iter([])) == {}
+
+def test_facet_filter_query():
+    query = str(CatalogEntry.objects.filter(facet_filter(1, None, {'Color': ['red', 'blue'], 'Size': ['S']})).query)
+
+    assert query.count('jsonb_array_elements_text') == 2
+    assert 'product_info_ids' in query
+
+
+@pytest.mark.django_db
+def test_catalog_facets_follow_state(api_client_partner, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=4, parameters=1))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    url = reverse('api:products-list')
+
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+    hidden = api_client.get(url, {'facets': 'true'}).json()
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'true'})
+    shown = api_client.get(url, {'facets': 'true'}).json()
+
+    assert hidden['facets'] == {}
+    assert shown['facets'] == {'Parameter 0': {'value 0': 1, 'value 1': 1, 'value 2': 1, 'value 3': 1}}
+
+
+@pytest.fixture(params=(
+    ('locmem', 'LocMemCache'),
+    ('filebased', 'FileBasedCache'),
+    ('db', 'DatabaseCache'),
+))
+def catalog_cache(request, settings, tmp_path):
+    module, backend = request.param
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'catalog': {
+            'BACKEND': f'django.core.cache.backends.{module}.{backend}',
+            'LOCATION': 'cache_table' if module == 'db' else str(tmp_path),
+        },
+    }
+    settings.CATALOG_CACHE = 'catalog'
+
+
+@pytest.mark.django_db
+def test_catalog_cache(api_client_partner, api_client, price_list, feed_server, catalog_cache):
+    partner_client, _ = api_client_partner
+    data = price_list(goods=4)
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_id = ImportJob.objects.get().shop_id
+    url = reverse('api:products-list')
+
+    first = api_client.get(url, {'limit': 10, 'shop_id': shop_id}).json()
+    with CaptureQueriesContext(connection) as context:
+        cached = api_client.get(url, {'shop_id': shop_id, 'limit': 10}).json()
+    data['goods'][0]['price'] += 5
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    imported = api_client.get(url, {'limit': 10, 'shop_id': shop_id}).json()
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+    hidden = api_client.get(url, {'limit': 10, 'shop_id': shop_id}).json()
+
+    assert cached == first
+    assert all('cache_table' in query['sql'] for query in context.captured_queries)
+    assert imported['results'][0]['price'] == first['results'][0]['price'] + 5
+    assert hidden['results'] == []
+
+
+@pytest.mark.django_db
+def test_catalog_cache_categories(api_client_admin, api_client, category, catalog_cache):
+    item = category()
+    url = reverse('api:categories-detail', args=[item.id])
+
+    first = api_client.get(url).json()
+    api_client_admin.patch(url, data={'name': 'Renamed'})
+    renamed = api_client.get(url).json()
+
+    assert first['name'] == item.name
+    assert renamed['name'] == 'Renamed'
+
+
+@pytest.mark.django_db
+def test_bump_versions(catalog_cache):
+    first = get_versions('catalog', 'shops')[0]
+    bump_versions('catalog')
+    bumped = get_versions('catalog', 'shops')[0]
+    bump_versions('catalog', 'shops')
+
+    assert bumped[0] != first[0]
+    assert bumped[1] == first[1]
+    assert not set(get_versions('catalog', 'shops')[0]) & set(first + bumped)
+
+
+def test_catalog_cache_check(settings):
+    local = check_catalog_cache(None)
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache_table'}}
+
+    assert [warning.id for warning in local] == ['api.W001']
+    assert check_catalog_cache(None) == []
+
+
+@pytest.mark.django_db
+def test_catalog_conditional_get(api_client_partner, api_client, price_list, feed_server, django_assert_num_queries):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=4))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    url = reverse('api:products-list')
+
+    first = api_client.get(url)
+    with django_assert_num_queries(0):
+        by_etag = api_client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        by_date = api_client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+    other_query = api_client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=first['ETag'])
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+    changed = api_client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    assert first.status_code == status.HTTP_200_OK
+    assert by_etag.status_code == status.HTTP_304_NOT_MODIFIED
+    assert by_etag['ETag'] == first['ETag']
+    assert not by_etag.content
+    assert by_date.status_code == status.HTTP_304_NOT_MODIFIED
+    assert other_query.status_code == status.HTTP_200_OK
+    assert changed.status_code == status.HTTP_200_OK
+    assert changed['ETag'] != first['ETag']
+    assert changed.json()['results'] == []
+
+
+@pytest.mark.django_db
+def test_catalog_stats(api_client_partner, api_client, price_list, feed_server, django_assert_max_num_queries):
+    partner_client, _ = api_client_partner
+    data = price_list(goods=9)
+    feed_server(data)
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_id = ImportJob.objects.get().shop_id
+    category = Category.objects.get(name='Category 0')
+
+    shop = api_client.get(reverse('api:shops-detail', args=[shop_id])).json()
+    with django_assert_max_num_queries(3):
+        categories = {item['name']: item for item in api_client.get(reverse('api:categories-list')).json()['results']}
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+    hidden = api_client.get(reverse('api:categories-detail', args=[category.id])).json()
+
+    assert shop['product_count'] == 9
+    assert shop['in_stock_count'] == 8
+    assert (shop['price_min'], shop['price_max']) == (100, 108)
+    assert categories['Category 0']['product_count'] == 3
+    assert categories['Category 0']['in_stock_count'] == 2
+    assert (categories['Category 0']['price_min'], categories['Category 0']['price_max']) == (100, 106)
+    assert hidden['product_count'] == 0
+    assert hidden['price_min'] is None
+
+
+@pytest.mark.django_db
+def test_catalog_stats_shop_update(api_client_partner, api_client_admin, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=9))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_id = ImportJob.objects.get().shop_id
+    url = reverse('api:categories-detail', args=[Category.objects.get(name='Category 0').id])
+
+    first = api_client.get(url).json()
+    api_client_admin.patch(reverse('api:shops-detail', args=[shop_id]), data={'state': False})
+    hidden = api_client.get(url).json()
+
+    assert first['product_count'] == 3
+    assert hidden['product_count'] == 0
+
+
+@pytest.mark.django_db
+def test_catalog_stats_destroy(api_client_partner, api_client_admin, api_client, price_list, feed_server):
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=9))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_url = reverse('api:shops-detail', args=[ImportJob.objects.get().shop_id])
+    category_url = reverse('api:categories-detail', args=[Category.objects.get(name='Category 1').id])
+    first = (api_client.get(shop_url).json()['product_count'], api_client.get(category_url).json()['product_count'])
+
+    api_client_admin.delete(reverse('api:categories-detail', args=[Category.objects.get(name='Category 0').id]))
+    shop_count = api_client.get(shop_url).json()['product_count']
+    api_client_admin.delete(shop_url)
+    category_count = api_client.get(category_url).json()['product_count']
+
+    assert first == (9, 3)
+    assert shop_count == 6
+    assert category_count == 0
+
+def get_catalog_pages(client, params):
+    pages, cursor = [], None
+    while True:
+        data = client.get(reverse('api:products-list'), {**params, 'limit': 2, 'cursor': cursor or ''})
+        pages.append(data.json()['results'])
+        cursor = data.json()['next_cursor']
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.django_db
+def test_catalog_snapshot(api_client_partner, api_client, price_list, feed_server, settings, tmp_path,
+                          django_assert_num_queries):
+    settings.CATALOG_SNAPSHOT_PATH = str(tmp_path / 'catalog.snapshot')
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=7))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_id = ImportJob.objects.get().shop_id
+    category_id = Category.objects.get(name='Category 1').id
+    queries = ({}, {'shop_id': shop_id}, {'category_id': category_id},
+               {'shop_id': shop_id, 'category_id': category_id}, {'shop_id': shop_id + 1},
+               {'fields': 'id,price', 'expand': 'product_parameters'})
+
+    snapshot = get_snapshot()
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        statements.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        from_snapshot = [get_catalog_pages(api_client, params) for params in queries[:-1]]
+    with django_assert_num_queries(0):
+        from_snapshot.append(get_catalog_pages(api_client, queries[-1]))
+    settings.CATALOG_SNAPSHOT_PATH = None
+    from_database = [get_catalog_pages(api_client, {**params, 'nocache': 1}) for params in queries]
+    settings.CATALOG_SNAPSHOT_PATH = str(tmp_path / 'catalog.snapshot')
+    bump_catalog_versions()
+    unchanged = get_snapshot()
+    bump_catalog_versions(snapshot=True)
+    stale = get_snapshot()
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'false'})
+
+    assert snapshot.count == 7
+    assert from_snapshot == from_database
+    assert len(statements) == sum(1 for pages in from_snapshot[:-1] for page in pages if page)
+    assert all('"quantity"' in sql and ' IN (' in sql for sql in statements)
+    assert sum(len(page) for page in from_snapshot[2]) == 2
+    assert from_snapshot[4] == [[]]
+    assert unchanged is snapshot
+    assert stale is None
+    assert get_snapshot().count == 0
+    assert api_client.get(reverse('api:products-list')).json()['results'] == []
+
+
+@pytest.mark.django_db
+def test_catalog_snapshot_admin(api_client_partner, api_client_admin, price_list, feed_server, settings, tmp_path):
+    settings.CATALOG_SNAPSHOT_PATH = str(tmp_path / 'catalog.snapshot')
+    partner_client, _ = api_client_partner
+    feed_server(price_list(goods=7))
+    partner_client.post(reverse('api:partner-update-list'), data={'url': 'https://example.com/shop.yaml'})
+    shop_id = ImportJob.objects.get().shop_id
+
+    api_client_admin.post(reverse('api:categories-list'), data={'name': 'New category'})
+    created = get_snapshot()
+    api_client_admin.delete(reverse('api:categories-detail', args=[Category.objects.get(name='Category 0').id]))
+    category_deleted = get_snapshot()
+    api_client_admin.patch(reverse('api:shops-detail', args=[shop_id]), data={'state': False})
+    shop_hidden = get_snapshot()
+    partner_client.patch(reverse('api:partner-state-list'), data={'state': 'true'})
+    shown = get_snapshot()
+    deleted = api_client_admin.delete(reverse('api:shops-detail', args=[shop_id]))
+
+    assert created.count == 7
+    assert category_deleted.count == 4
+    assert shop_hidden.count == 0
+    assert shown.count == 4
+    assert deleted.status_code == status.HTTP_204_NO_CONTENT
+    assert get_snapshot().count == 0
+
+
+def test_single_flight():
+    calls, started, release = [], threading.Event(), threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    with ThreadPoolExecutor(8) as executor:
+        leader = executor.submit(single_flight, 'products', compute)
+        started.wait(5)
+        followers = [executor.submit(single_flight, 'products', compute) for _ in range(7)]
+        time.sleep(0.2)
+        release.set()
+    again = single_flight('products', compute)
+
+    assert leader.result() == 1
+    assert [future.result() for future in followers] == [1] * 7
+    assert again == 2
+
+
+def test_single_flight_lock(settings):
+    settings.SINGLE_FLIGHT_POLL_INTERVAL = 0.01
+    cache = caches['default']
+    cache.add('single-flight:products', 1, 30)
+    threading.Timer(0.05, cache.set, ('result', 'shared')).start()
+    shared = single_flight('products', lambda: 'computed', lambda: cache.get('result'), cache)
+    cache.delete('result')
+    threading.Timer(0.05, cache.delete, ('single-flight:products',)).start()
+    computed = single_flight('products', lambda: 'computed', lambda: cache.get('result'), cache)
+
+    assert shared == 'shared'
+    assert computed == 'computed'
+    assert cache.get('single-flight:products') is None
+
+
+@pytest.mark.django_db
+def test_shop_update_invalid_feed(api_client_partner, feed_server):
+    url = reverse('api:partner-update-list')
+    api_client, _ = api_client_partner
+    feed_server(['not', 'a', 'price', 'list'])
+
+    resp = api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+    job = ImportJob.objects.get(id=resp.json()['id'])
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert job.status == 'failed'
+    assert job.errors
+
+
+@pytest.mark.django_db
+def test_shop_update_one_active_job(api_client_partner):
+    url = reverse('api:partner-update-list')
+    api_client, user = api_client_partner
+    job = ImportJob.objects.create(user=user, url='https://example.com/shop.yaml', status='running')
+
+    resp = api_client.post(url, data={'url': 'https://example.com/shop.yaml'})
+
+    assert resp.status_code == status.HTTP_409_CONFLICT
+    assert resp.json()['id'] == job.id
+
+
+@pytest.mark.django_db
+def test_get_import_job_fail(api_client_partner, user):
+    api_client, _ = api_client_partner
+    job = ImportJob.objects.create(user=user(type='shop'), url='https://example.com/shop.yaml')
+
+    resp = api_client.get(reverse('api:partner-update-detail', args=(job.id,)))
+
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    ['encoding', 'compress'],
+    (
+        (None, lambda content: content),
+        ('gzip', gzip.compress),
+    )
+)
+@pytest.mark.django_db
+def test_shop_upload(api_client_partner, price_list, encoding, compress):
+    url = reverse('api:partner-upload-list')
+    api_client, user = api_client_partner
+    content = yaml.dump(price_list(goods=12), allow_unicode=True, sort_keys=False).encode()
+    headers = {'HTTP_CONTENT_ENCODING': encoding} if encoding else {}
+
+    resp = api_client.generic('POST', url, compress(content), content_type='application/x-yaml', **headers)
+    job = ImportJob.objects.get(id=resp.json()['id'])
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert job.status == 'done'
+    assert ProductInfo.objects.filter(shop__user=user).count() == 12
+
+
+@pytest.mark.django_db
+def test_shop_upload_multipart(api_client_partner, price_list):
+    url = reverse('api:partner-upload-list')
+    api_client, user = api_client_partner
+    content = yaml.dump(price_list(goods=7), allow_unicode=True, sort_keys=False).encode()
+    upload = SimpleUploadedFile('shop.yaml.gz', gzip.compress(content), content_type='application/gzip')
+
+    resp = api_client.post(url, data={'file': upload}, format='multipart')
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert ProductInfo.objects.filter(shop__user=user).count() == 7
+
+
+@pytest.mark.django_db
+def test_shop_upload_zstd(api_client_partner, price_list):
+    zstandard = pytest.importorskip('zstandard')
+    url = reverse('api:partner-upload-list')
+    api_client, user = api_client_partner
+    content = yaml.dump(price_list(goods=9), allow_unicode=True, sort_keys=False).encode()
+
+    resp = api_client.generic('POST', url, zstandard.ZstdCompressor().compress(content),
+                              content_type='application/x-yaml', HTTP_CONTENT_ENCODING='zstd')
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert ProductInfo.objects.filter(shop__user=user).count() == 9
+
+
+@pytest.mark.django_db
+def test_shop_upload_bad_encoding(api_client_partner):
+    url = reverse('api:partner-upload-list')
+    api_client, _ = api_client_partner
+
+    resp = api_client.generic('POST', url, b'shop: test', content_type='application/x-yaml',
+                              HTTP_CONTENT_ENCODING='br')
+
+    assert resp.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    assert not ImportJob.objects.exists()
+
+
+@pytest.mark.django_db
+def test_shop_upload_too_large(api_client_partner, settings, import_upload_dir):
+    settings.IMPORT_MAX_FEED_SIZE = 1024 * 1024
+    url = reverse('api:partner-upload-list')
+    api_client, _ = api_client_partner
+
+    resp = api_client.generic('POST', url, gzip.compress(b' ' * (2 * 1024 * 1024)), content_type='application/x-yaml',
+                              HTTP_CONTENT_ENCODING='gzip')
+
+    assert resp.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert not ImportJob.objects.exists()
+    assert not any(import_upload_dir.iterdir())
+
+
+@pytest.mark.django_db
+def test_shop_upload_queued(api_client_partner, price_list, user_factory, settings, import_upload_dir):
+    settings.IMPORT_JOB_WORKERS = 4
+    url = reverse('api:partner-upload-list')
+    api_client, user = api_client_partner
+    content = yaml.dump(price_list(goods=4), allow_unicode=True, sort_keys=False).encode()
+    receiving = baker.make('api.ImportJob', user=user_factory(type='shop'), status='queued')
+
+    resp = api_client.generic('POST', url, content, content_type='application/x-yaml')
+    job = ImportJob.objects.get(id=resp.json()['id'])
+
+    assert resp.status_code == status.HTTP_202_ACCEPTED
+    assert job.status == 'queued'
+    with open(job.upload, 'rb') as upload:
+        assert upload.read() == content
+
+    out = StringIO()
+    call_command('run_import_jobs', once=True, stdout=out)
+    job.refresh_from_db()
+    receiving.refresh_from_db()
+
+    assert job.status == 'done'
+    assert job.upload == ''
+    assert receiving.status == 'queued'
+    assert ProductInfo.objects.filter(shop__user=user).count() == 4
+    assert not any(import_upload_dir.iterdir())
+    assert 'Выполнено задач: 1' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_shop_upload_conflict(api_client_partner, price_list, monkeypatch):
+    url = reverse('api:partner-upload-list')
+    api_client, user = api_client_partner
+    job = baker.make('api.ImportJob', user=user, status='running')
+    monkeypatch.setattr('api.views.spool_upload', lambda *args, **kwargs: pytest.fail('Прайс прочитан'))
+    content = yaml.dump(price_list(goods=3), allow_unicode=True, sort_keys=False).encode()
+
+    resp = api_client.generic('POST', url, content, content_type='application/x-yaml')
+
+    assert resp.status_code == status.HTTP_409_CONFLICT
+    assert resp.json()['id'] == job.id
+
+
+@pytest.mark.django_db
+def test_refresh_feeds(price_list, feed_server, user):
+    feed_server(price_list(goods=5))
+    partners = [user(is_active=True, type='shop') for _ in range(3)]
+    for partner in partners[:2]:
+        baker.make('api.Shop', user=partner, url='https://example.com/shop.yaml')
+    baker.make('api.Shop', user=partners[2])
+    out = StringIO()
+
+    call_command('refresh_feeds', once=True, workers=0, jitter=0, stdout=out)
+    call_command('refresh_feeds', once=True, workers=0, jitter=0, stdout=out)
+
+    assert ImportJob.objects.filter(status='done').count() == 4
+    assert ProductInfo.objects.count() == 10
+    assert 'Обновлено: 2' in out.getvalue()
+    assert 'пропущено: 2' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_refresh_feeds_unexpected_error(price_list, feed_server, user, monkeypatch):
+    feed_server(price_list(goods=5))
+
+    def broken_fetch_feed(url, shop=None):
+        if 'broken' in url:
+            raise RuntimeError('Сбой')
+        return fetch_feed(url, shop)
+
+    monkeypatch.setattr('api.jobs.fetch_feed', broken_fetch_feed)
+    broken = baker.make('api.Shop', user=user(is_active=True, type='shop'), url='https://broken.example.com/shop.yaml')
+    baker.make('api.Shop', user=user(is_active=True, type='shop'), url='https://example.com/shop.yaml')
+    out, err = StringIO(), StringIO()
+
+    call_command('refresh_feeds', once=True, workers=0, jitter=0, stdout=out, stderr=err)
+
+    assert 'Обновлено: 1' in out.getvalue()
+    assert 'ошибок: 1' in out.getvalue()
+    assert f'Магазин {broken.id}: RuntimeError: Сбой' in err.getvalue()
 
 
 @pytest.mark.django_db
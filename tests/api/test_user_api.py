@@ -1,9 +1,29 @@
+import gzip
+import io
 import json
 import pytest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
 from random import randint
+from django.db import connection
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from api.models import ConfirmEmailToken
+from rest_framework.renderers import JSONRenderer
+from model_bakery import baker
+from api.catalog import refresh_catalog_entries
+from api.fast_serializers import CATALOG_ENTRY_VALUES, serialize_catalog_entries, serialize_orders, \
+    serialize_product_infos
+from api.lookups import TrigramWordSimilar
+from api.models import ConfirmEmailToken, Order, OrderItem, ProductInfo, CatalogEntry
+from api.pagination import KeysetPagination
+from api.renderers import ORJSONRenderer, ORJSONParser
+from api.reservations import InsufficientStock, release_order, reserve_order
+from api.serializers import OrderSerializer, ProductInfoSerializer, CatalogEntrySerializer
+from api.snapshot import get_snapshot, rebuild_snapshot
 
 
 @pytest.mark.parametrize(
@@ -238,7 +258,222 @@ def test_get_products_info(api_client, product_info):
     resp_json = resp.json()
 
     assert resp.status_code == status.HTTP_200_OK
-    assert len(resp_json) == 10
+    assert len(resp_json['results']) == 10
+    assert resp_json['next'] is None
+
+
+@pytest.mark.django_db
+def test_get_products_info_cursor(api_client, product_info):
+    url = reverse('api:products-list')
+    ids = sorted(item.id for item in product_info(_quantity=10))
+    seen = []
+
+    resp_json = api_client.get(url, {'limit': 3}).json()
+    seen += [item['id'] for item in resp_json['results']]
+    while resp_json['next_cursor']:
+        resp_json = api_client.get(url, {'limit': 3, 'cursor': resp_json['next_cursor']}).json()
+        seen += [item['id'] for item in resp_json['results']]
+
+    assert seen == ids
+
+
+@pytest.mark.parametrize('params', (
+    {'cursor': 'not-a-cursor'},
+    {'cursor': KeysetPagination().encode_cursor(['abc'])},
+    {'cursor': KeysetPagination().encode_cursor([{'a': 1}])},
+    {'cursor': KeysetPagination().encode_cursor([True, 1]), 'ordering': 'price'},
+    {'cursor': KeysetPagination().encode_cursor(['abc', 1]), 'ordering': 'price'},
+))
+@pytest.mark.django_db
+def test_get_products_info_cursor_fail(api_client, product_info, params):
+    url = reverse('api:products-list')
+    product_info(_quantity=2)
+
+    resp = api_client.get(url, params)
+
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('ordering', ('price', '-price', 'quantity', '-quantity'))
+@pytest.mark.django_db
+def test_get_products_info_ordering(api_client, product_info, ordering):
+    url = reverse('api:products-list')
+    items = product_info(_quantity=10)
+    field = ordering.lstrip('-')
+    expected = [
+        item.id for item in sorted(items, key=lambda item: (getattr(item, field), item.id), reverse=ordering[0] == '-')
+    ]
+    seen = []
+
+    resp_json = api_client.get(url, {'ordering': ordering, 'limit': 3}).json()
+    seen += [item['id'] for item in resp_json['results']]
+    while resp_json['next_cursor']:
+        resp_json = api_client.get(url, {'ordering': ordering, 'limit': 3, 'cursor': resp_json['next_cursor']}).json()
+        seen += [item['id'] for item in resp_json['results']]
+
+    assert seen == expected
+
+
+@pytest.mark.django_db
+def test_get_products_info_price_range(api_client, product_info):
+    url = reverse('api:products-list')
+    items = product_info(_quantity=10)
+    prices = sorted(item.price for item in items)
+    price_min, price_max = prices[2], prices[7]
+
+    resp = api_client.get(url, {'price_min': price_min, 'price_max': price_max, 'ordering': 'price'})
+
+    assert resp.status_code == status.HTTP_200_OK
+    for item in resp.json()['results']:
+        assert price_min <= int(item['price']) <= price_max
+    assert len(resp.json()['results']) == len([price for price in prices if price_min <= price <= price_max])
+
+
+@pytest.mark.parametrize('params', ({'ordering': 'name'}, {'price_min': 'cheap'}, {'shop_id': 'abc'},
+                                    {'category_id': '1.5'}))
+@pytest.mark.django_db
+def test_get_products_info_ordering_fail(api_client, params):
+    url = reverse('api:products-list')
+
+    resp = api_client.get(url, params)
+
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.parametrize(
+    ['params', 'fields'],
+    (
+        ({'fields': 'id,price,quantity'}, ['id', 'quantity', 'price']),
+        ({'expand': 'product'}, ['id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc']),
+        ({'fields': 'id', 'expand': 'product_parameters'}, ['id', 'product_parameters']),
+        ({}, ['id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters']),
+    )
+)
+@pytest.mark.django_db
+def test_get_products_info_fields(api_client, product_info, params, fields):
+    url = reverse('api:products-list')
+    product_info(_quantity=3)
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api_client.get(url, params)
+    columns = queries[-1]['sql'].split(' FROM ')[0]
+
+    assert resp.status_code == status.HTTP_200_OK
+    for item in resp.json()['results']:
+        assert list(item) == fields
+    assert ('"parameters"' in columns) == ('product_parameters' in fields)
+    assert ('"product_name"' in columns) == ('product' in fields)
+
+
+@pytest.mark.django_db
+def test_get_products_info_fields_fail(api_client):
+    resp = api_client.get(reverse('api:products-list'), {'fields': 'id,password'})
+
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.parametrize('encoding', ('', 'gzip'))
+@pytest.mark.django_db
+def test_export_products_info(api_client, product_info, settings, encoding):
+    settings.CATALOG_EXPORT_CHUNK_SIZE = 3
+    url = reverse('api:products-export')
+    items = product_info(_quantity=10)
+    hidden = product_info(is_active=False)
+    refresh_catalog_entries([hidden.id])
+    expected = api_client.get(reverse('api:products-list'), {'limit': 100}).json()['results']
+
+    resp = api_client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+    content = b''.join(resp.streaming_content)
+    if encoding:
+        content = gzip.decompress(content)
+    lines = [json.loads(line) for line in content.decode().splitlines()]
+
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp['Content-Type'] == 'application/x-ndjson'
+    assert resp.get('Content-Encoding', '') == encoding
+    assert lines == expected
+    assert len(lines) == len(items)
+
+
+@pytest.mark.django_db
+def test_export_products_info_fields(api_client, product_info):
+    url = reverse('api:products-export')
+    product_info(_quantity=3)
+
+    resp = api_client.get(url, {'fields': 'id,price'})
+    lines = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+    fail = api_client.get(url, {'fields': 'secret'})
+
+    assert [list(line) for line in lines] == [['id', 'price']] * 3
+    assert fail.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_search_products_info(api_client, product_info):
+    url = reverse('api:products-list')
+    phone = product_info(model='SuperPhone X200')
+    product_info(model='Другая модель')
+    parameter = baker.make(
+        'api.ProductParameter', product_info_id=phone.id, parameter=baker.make('api.Parameter'), value='Graphite'
+    )
+    refresh_catalog_entries([phone.id])
+
+    for text in ('superphone', 'x200 superphone', parameter.value.lower()):
+        resp = api_client.get(url, {'q': text})
+        resp_json = resp.json()
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in resp_json['results']] == [phone.id]
+
+    resp_json = api_client.get(url, {'q': 'несуществующий'}).json()
+
+    assert resp_json['results'] == []
+
+
+def test_trigram_word_similar_lookup():
+    lookup = CatalogEntry._meta.get_field('search_text').get_lookup('trigram_word_similar')
+
+    assert lookup is TrigramWordSimilar
+    assert lookup.postgres_operator == '%%>'
+
+
+@pytest.mark.django_db
+def test_fast_serializers_match(user, order_items):
+    customer = user(is_active=True)
+    contact = baker.make('api.Contact', user=customer)
+    items = [order_items(user_id=customer.id, status='new') for _ in range(3)]
+    items[0].order.contact = contact
+    items[0].order.save()
+    baker.make('api.OrderItem', order=items[1].order, product_info=items[2].product_info, quantity=3)
+    for item in items:
+        baker.make('api.ProductParameter', product_info=item.product_info, parameter=baker.make('api.Parameter'))
+    refresh_catalog_entries([item.product_info_id for item in items])
+    orders = Order.objects.filter(user_id=customer.id).annotate(
+        total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
+    ).distinct()
+    product_infos = ProductInfo.objects.order_by('id')
+    catalog_entries = CatalogEntry.objects.order_by('pk')
+    render = JSONRenderer().render
+
+    assert render(serialize_orders(orders)) == render(OrderSerializer(orders, many=True).data)
+    assert render(serialize_product_infos(product_infos)) == \
+        render(ProductInfoSerializer(product_infos, many=True).data)
+    assert render(serialize_catalog_entries(catalog_entries.values(*CATALOG_ENTRY_VALUES))) == \
+        render(CatalogEntrySerializer(catalog_entries, many=True).data)
+
+
+def test_orjson_renderer_matches_json():
+    data = {
+        'text': 'Цена\u2028за шт. "1/2"',
+        'dt': datetime(2021, 11, 14, 18, 8, 4, 123456, tzinfo=timezone.utc),
+        'price': Decimal('10.50'),
+        'items': [OrderedDict([('id', 1), ('value', None)]), {2: True, 'float': 0.1}],
+    }
+
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+    assert ORJSONRenderer().render(data, 'application/json; indent=4') == \
+        JSONRenderer().render(data, 'application/json; indent=4')
+    assert ORJSONParser().parse(io.BytesIO(JSONRenderer().render(data))) == json.loads(JSONRenderer().render(data))
 
 
 @pytest.mark.django_db
@@ -274,6 +509,97 @@ def test_create_cart(api_client_auth, product_info):
     assert resp_json['Создано объектов'] > 0
 
 
+@pytest.mark.django_db
+def test_create_cart_json(api_client_auth, product_info):
+    url = reverse("api:cart-list")
+    api_client, _ = api_client_auth
+    items = [{'product_info': item.id, 'quantity': randint(1, 10)} for item in product_info(_quantity=3)]
+
+    resp = api_client.post(url, data={'items': items}, format='json')
+
+    assert resp.status_code == status.HTTP_201_CREATED
+    assert resp.json()['Создано объектов'] == 3
+
+
+@pytest.mark.django_db
+def test_create_cart_upsert(api_client_auth, product_info, django_assert_max_num_queries):
+    url = reverse("api:cart-list")
+    api_client, user = api_client_auth
+    products = product_info(_quantity=200)
+    api_client.post(url, data={'items': [{'product_info': products[0].id, 'quantity': 2}]}, format='json')
+    items = [{'product_info': item.id, 'quantity': 1} for item in products] + \
+            [{'product_info': products[1].id, 'quantity': 3}]
+
+    with django_assert_max_num_queries(8):
+        resp = api_client.post(url, data={'items': items}, format='json')
+    quantities = dict(OrderItem.objects.filter(order__user=user).values_list('product_info_id', 'quantity'))
+
+    assert resp.status_code == status.HTTP_201_CREATED
+    assert resp.json() == {'Создано объектов': 199, 'Обновлено объектов': 1}
+    assert len(quantities) == 200
+    assert quantities[products[0].id] == 3
+    assert quantities[products[1].id] == 4
+
+
+@pytest.mark.django_db
+def test_create_cart_unavailable(api_client_auth, product_info):
+    api_client, user = api_client_auth
+    retired, hidden, active = product_info(), product_info(), product_info()
+    cart = baker.make('api.Order', user=user, status='cart')
+    for item in (retired, hidden, active):
+        baker.make('api.OrderItem', order=cart, product_info=item, quantity=1)
+    ProductInfo.objects.filter(id=retired.id).update(is_active=False)
+    hidden.shop.state = False
+    hidden.shop.save()
+    items = [{'product_info': item.id, 'quantity': 1} for item in (retired, hidden, active)]
+
+    added = api_client.post(reverse('api:cart-list'), data={'items': items}, format='json')
+    ordered = api_client.post(reverse('api:order-list'), data={'id': cart.id, 'contact': user.contacts.get().id})
+
+    assert added.status_code == status.HTTP_400_BAD_REQUEST
+    assert added.json()['Errors'] == f'Товары не найдены: {retired.id}, {hidden.id}'
+    assert ordered.status_code == status.HTTP_409_CONFLICT
+    assert [item['product_info'] for item in ordered.json()['Позиции']] == [retired.id, hidden.id]
+    assert Order.objects.get(id=cart.id).status == 'cart'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(['product_info_id', 'quantity'], ((0, 1), ('x', 1), (None, 1), ('valid', 0)))
+def test_create_cart_fail(api_client_auth, product_info, product_info_id, quantity):
+    url = reverse("api:cart-list")
+    api_client, user = api_client_auth
+    product = product_info(_quantity=1)[0]
+    items = [
+        {'product_info': product.id, 'quantity': 1},
+        {'product_info': product.id if product_info_id == 'valid' else product_info_id, 'quantity': quantity},
+    ]
+
+    resp = api_client.post(url, data={'items': items}, format='json')
+
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert resp.json()['Errors']
+    assert not OrderItem.objects.filter(order__user=user).exists()
+
+
+@pytest.mark.django_db
+def test_cart_msgpack(api_client_auth, product_info):
+    msgpack = pytest.importorskip('msgpack')
+    url = reverse("api:cart-list")
+    api_client, _ = api_client_auth
+    items = [{'product_info': item.id, 'quantity': randint(1, 10)} for item in product_info(_quantity=3)]
+
+    created = api_client.post(
+        url, data=msgpack.packb({'items': items}), content_type='application/msgpack',
+        HTTP_ACCEPT='application/msgpack'
+    )
+    cart = api_client.get(url, HTTP_ACCEPT='application/msgpack')
+
+    assert created.status_code == status.HTTP_201_CREATED
+    assert msgpack.unpackb(created.content) == {'Создано объектов': 3, 'Обновлено объектов': 0}
+    assert cart['Content-Type'] == 'application/msgpack'
+    assert msgpack.unpackb(cart.content) == api_client.get(url).json()
+
+
 @pytest.mark.django_db
 def test_update_cart(api_client_auth, order_items):
     api_client, user = api_client_auth
@@ -307,6 +633,57 @@ def test_delete_cart(api_client_auth, order_items):
     assert resp_json.get('Удалено объектов', 0) > 0
 
 
+@pytest.mark.django_db
+def test_bulk_update_delete_cart(api_client_auth, product_info, order_items, django_assert_max_num_queries):
+    api_client, user = api_client_auth
+    products = product_info(_quantity=100)
+    api_client.post(reverse('api:cart-list'), data={'items': [
+        {'product_info': item.id, 'quantity': 1} for item in products
+    ]}, format='json')
+    ids = list(OrderItem.objects.filter(order__user=user).order_by('id').values_list('id', flat=True))
+    foreign = order_items(user_id=baker.make('api.User').id, status='cart').id
+    url = reverse('api:cart-detail', args=(OrderItem.objects.get(id=ids[0]).order_id,))
+    items = [{'id': item_id, 'quantity': index + 2} for index, item_id in enumerate(ids)]
+
+    with django_assert_max_num_queries(6):
+        updated = api_client.patch(url, data={'items': items + [
+            {'id': foreign, 'quantity': 1}, {'id': ids[0], 'quantity': 0}, {'id': 'x', 'quantity': 1}
+        ]}, format='json').json()
+    quantities = dict(OrderItem.objects.filter(id__in=ids).values_list('id', 'quantity'))
+    with django_assert_max_num_queries(6):
+        deleted = api_client.delete(url, data={'items': ids[:50] + [foreign, 'x']}, format='json').json()
+
+    assert updated['Обновлено объектов'] == 100
+    assert updated['Позиции'][:100] == [{'id': item_id, 'Status': True} for item_id in ids]
+    assert updated['Позиции'][100:] == [
+        {'id': foreign, 'Status': False, 'Errors': 'Позиция не найдена'},
+        {'id': ids[0], 'Status': False, 'Errors': 'Неверное количество товара'},
+        {'id': 'x', 'Status': False, 'Errors': 'Неверный формат позиции'},
+    ]
+    assert quantities == {item_id: index + 2 for index, item_id in enumerate(ids)}
+    assert deleted['Удалено объектов'] == 50
+    assert deleted['Позиции'][50:] == [
+        {'id': foreign, 'Status': False, 'Errors': 'Позиция не найдена'},
+        {'id': 'x', 'Status': False, 'Errors': 'Неверный формат позиции'},
+    ]
+    assert set(OrderItem.objects.filter(order__user=user).values_list('id', flat=True)) == set(ids[50:])
+    assert OrderItem.objects.filter(id=foreign).exists()
+
+
+@pytest.mark.django_db
+def test_update_cart_after_checkout(api_client_auth, order_items):
+    api_client, user = api_client_auth
+    item = order_items(user_id=user.id, status='new')
+    url = reverse('api:cart-detail', args=(item.order_id,))
+
+    updated = api_client.patch(url, data={'items': [{'id': item.id, 'quantity': item.quantity + 1}]}, format='json')
+    deleted = api_client.delete(url, data={'items': [item.id]}, format='json')
+
+    assert updated.json()['Обновлено объектов'] == 0
+    assert deleted.json()['Удалено объектов'] == 0
+    assert OrderItem.objects.get(id=item.id).quantity == item.quantity
+
+
 @pytest.mark.parametrize(
     ['status_', 'bool_'],
     (
@@ -332,6 +709,37 @@ def test_get_order(api_client_auth, order_items, status_, bool_):
     assert bool(resp_json) == bool_
 
 
+@pytest.mark.django_db
+def test_get_order_fields(api_client_auth, order_items):
+    url = reverse("api:order-list")
+    api_client, user = api_client_auth
+    order_items(user_id=user.id, status='new')
+
+    with CaptureQueriesContext(connection) as short_queries:
+        short = api_client.get(url, {'fields': 'id,status'}).json()
+    with CaptureQueriesContext(connection) as expanded_queries:
+        expanded = api_client.get(url, {'fields': 'id,ordered_items', 'expand': 'product'}).json()
+
+    assert list(short[0]) == ['id', 'status']
+    assert not any('api_orderitem' in query['sql'] for query in short_queries)
+    assert list(expanded[0]) == ['id', 'ordered_items']
+    assert list(expanded[0]['ordered_items'][0]['product_info']) == [
+        'id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc'
+    ]
+    assert not any('api_productparameter' in query['sql'] for query in expanded_queries)
+
+
+@pytest.mark.parametrize('params', ({'fields': 'id,secret'}, {'expand': 'contact'}))
+@pytest.mark.django_db
+def test_get_order_fields_fail(api_client_auth, params):
+    url = reverse("api:order-list")
+    api_client, _ = api_client_auth
+
+    resp = api_client.get(url, params)
+
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.django_db
 def test_create_order(api_client_auth, order_items):
     url = reverse("api:order-list")
@@ -344,3 +752,104 @@ def test_create_order(api_client_auth, order_items):
     })
 
     assert resp.status_code == status.HTTP_201_CREATED
+
+
+@pytest.mark.django_db
+def test_create_order_reserves_stock(api_client_auth, product_info):
+    api_client, user = api_client_auth
+    products = product_info(quantity=5, _quantity=3)
+    cart = baker.make('api.Order', user=user, status='cart')
+    for item, quantity in zip(products, (5, 2, 7)):
+        baker.make('api.OrderItem', order=cart, product_info=item, quantity=quantity)
+    data = {'id': cart.id, 'contact': user.contacts.get().id}
+
+    short = api_client.post(reverse('api:order-list'), data=data)
+    ids = [item.id for item in products]
+    unchanged = list(ProductInfo.objects.filter(id__in=ids).order_by('id').values_list('quantity', flat=True))
+    OrderItem.objects.filter(order=cart, product_info=products[2]).update(quantity=1)
+    created = api_client.post(reverse('api:order-list'), data=data)
+    stock = dict(ProductInfo.objects.values_list('id', 'quantity'))
+    reserved = dict(ProductInfo.objects.values_list('id', 'reserved'))
+    catalog = dict(CatalogEntry.objects.values_list('pk', 'quantity'))
+    ordered = api_client.get(reverse('api:order-list')).json()[0]['ordered_items']
+    canceled = api_client.post(reverse('api:order-cancel', args=(cart.id,)))
+    canceled_again = api_client.post(reverse('api:order-cancel', args=(cart.id,)))
+
+    assert short.status_code == status.HTTP_409_CONFLICT
+    assert short.json()['Позиции'] == [{'product_info': products[2].id, 'quantity': 7, 'available': 5}]
+    assert unchanged == [5, 5, 5]
+    assert created.status_code == status.HTTP_201_CREATED
+    assert [stock[item.id] for item in products] == [5, 5, 5]
+    assert [reserved[item.id] for item in products] == [5, 2, 1]
+    assert [catalog[item.id] for item in products] == [0, 3, 4]
+    assert sorted(item['product_info']['quantity'] for item in ordered) == [0, 3, 4]
+    assert canceled.status_code == status.HTTP_200_OK
+    assert Order.objects.get(id=cart.id).status == 'canceled'
+    assert list(ProductInfo.objects.filter(id__in=ids).order_by('id').values_list('reserved', flat=True)) == [0, 0, 0]
+    assert list(CatalogEntry.objects.filter(pk__in=ids).order_by('pk').values_list('quantity', flat=True)) == [5, 5, 5]
+    assert canceled_again.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_create_order_snapshot(api_client_auth, product_info, settings, tmp_path):
+    settings.CATALOG_SNAPSHOT_PATH = str(tmp_path / 'catalog.snapshot')
+    api_client, user = api_client_auth
+    product = product_info(quantity=5)
+    rebuild_snapshot()
+    snapshot = get_snapshot()
+    cart = baker.make('api.Order', user=user, status='cart')
+    baker.make('api.OrderItem', order=cart, product_info=product, quantity=2)
+
+    api_client.post(reverse('api:order-list'), data={'id': cart.id, 'contact': user.contacts.get().id})
+    reserved = api_client.get(reverse('api:products-list')).json()['results']
+    api_client.post(reverse('api:order-cancel', args=(cart.id,)))
+    released = api_client.get(reverse('api:products-list')).json()['results']
+
+    assert [item['quantity'] for item in reserved] == [3]
+    assert [item['quantity'] for item in released] == [5]
+    assert get_snapshot() is snapshot
+
+
+@pytest.mark.django_db
+def test_sent_order_consumes_reserve(api_client_auth, product_info):
+    api_client, user = api_client_auth
+    product = product_info(quantity=5)
+    cart = baker.make('api.Order', user=user, status='cart')
+    baker.make('api.OrderItem', order=cart, product_info=product, quantity=5)
+    api_client.post(reverse('api:order-list'), data={'id': cart.id, 'contact': user.contacts.get().id})
+    reserved = ProductInfo.objects.get(id=product.id).reserved
+
+    order = Order.objects.get(id=cart.id)
+    order.status = 'delivered'
+    order.save()
+    product.refresh_from_db()
+
+    assert reserved == 5
+    assert product.reserved == 0
+    assert CatalogEntry.objects.get(pk=product.id).quantity == 5
+    assert release_order(cart.id, user.id) is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_order_concurrent(product_info):
+    if connection.vendor == 'sqlite':
+        pytest.skip('SQLite не поддерживает одновременную запись из нескольких соединений')
+    user = baker.make('api.User')
+    product = product_info(quantity=50)
+    carts = baker.make('api.Order', user=user, status='cart', _quantity=200)
+    baker.make('api.OrderItem', order=iter(carts), product_info=product, quantity=1, _quantity=200)
+
+    def checkout(cart_id):
+        try:
+            return reserve_order(cart_id, user.id, None)
+        except InsufficientStock:
+            return False
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(checkout, [cart.id for cart in carts], timeout=60))
+
+    assert results.count(True) == 50
+    assert ProductInfo.objects.get(id=product.id).reserved == 50
+    assert Order.objects.filter(status='new').count() == 50
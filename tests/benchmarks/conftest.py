@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RESULTS = []
+
+
+def reset_peak_rss():
+    """
+    Сброс пикового RSS процесса (Linux), чтобы измерять пик отдельного прогона
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@pytest.fixture
+def benchmark_result(record_property):
+    def func(name, **values):
+        RESULTS.append({'benchmark': name, **values})
+        for key, value in values.items():
+            record_property(key, value)
+    return func
+
+
+@pytest.fixture
+def feed_http_server():
+    feeds = {}
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = feeds.get(self.path)
+            if content is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-yaml')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def publish(path, content):
+        feeds[path] = content
+        return f'http://127.0.0.1:{server.server_port}{path}'
+
+    yield publish
+    server.shutdown()
+    server.server_close()
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.section('benchmarks')
+    for result in RESULTS:
+        terminalreporter.write_line(', '.join(f'{key}={value}' for key, value in result.items()))
+    output = os.environ.get('BENCHMARK_OUTPUT')
+    if output:
+        with open(output, 'a') as file:
+            for result in RESULTS:
+                file.write(json.dumps(result) + '\n')
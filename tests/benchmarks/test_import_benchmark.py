@@ -0,0 +1,51 @@
+import os
+import time
+import pytest
+import yaml
+from django.urls import reverse
+from api.models import ImportJob
+from .conftest import reset_peak_rss, peak_rss_mb
+
+try:
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
+
+GOODS = [int(value) for value in os.environ.get('BENCHMARK_GOODS', '1000,10000,100000').split(',')]
+PARAMETERS = int(os.environ.get('BENCHMARK_PARAMETERS', 5))
+
+
+def run_import(api_client, url):
+    reset_peak_rss()
+    started = time.perf_counter()
+    resp = api_client.post(reverse('api:partner-update-list'), data={'url': url})
+    seconds = time.perf_counter() - started
+    job = ImportJob.objects.get(id=resp.json()['id'])
+    assert job.status == 'done', job.errors
+    return job, seconds
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('goods', GOODS)
+@pytest.mark.django_db
+def test_import_benchmark(api_client_partner, price_list, feed_http_server, benchmark_result, goods):
+    api_client, _ = api_client_partner
+    data = price_list(goods=goods, parameters=PARAMETERS)
+    url = feed_http_server('/shop.yaml', yaml.dump(data, Dumper=Dumper, allow_unicode=True, sort_keys=False).encode())
+
+    job, seconds = run_import(api_client, url)
+    benchmark_result(
+        'import', goods=goods, parameters=PARAMETERS, seconds=round(seconds, 3),
+        rows_per_second=round(goods / seconds), queries=job.stats['queries'], peak_rss_mb=peak_rss_mb()
+    )
+
+    for item in data['goods'][::100]:
+        item['price'] += 1
+    url = feed_http_server('/shop.yaml', yaml.dump(data, Dumper=Dumper, allow_unicode=True, sort_keys=False).encode())
+
+    job, seconds = run_import(api_client, url)
+    benchmark_result(
+        'reimport_1pct_changed', goods=goods, parameters=PARAMETERS, seconds=round(seconds, 3),
+        rows_per_second=round(goods / seconds), queries=job.stats['queries'], peak_rss_mb=peak_rss_mb()
+    )
+    assert job.stats['updated'] == len(data['goods'][::100])
@@ -0,0 +1,106 @@
+import os
+import time
+import pytest
+from django.db.models import F, Sum
+from model_bakery import baker
+from rest_framework.renderers import JSONRenderer
+from api.catalog import refresh_catalog_entries
+from api.fast_serializers import CATALOG_ENTRY_VALUES, serialize_catalog_entries, serialize_orders, \
+    serialize_product_infos
+from api.models import CatalogEntry, Order, OrderItem, ProductInfo, ProductParameter
+from api.serializers import CatalogEntrySerializer, OrderSerializer, ProductInfoSerializer
+
+ROWS = [int(value) for value in os.environ.get('BENCHMARK_ROWS', '1000,10000').split(',')]
+PARAMETERS = int(os.environ.get('BENCHMARK_PARAMETERS', 5))
+ITEMS_PER_ORDER = 10
+
+
+def measure(func):
+    started = time.perf_counter()
+    content = JSONRenderer().render(func())
+    return content, time.perf_counter() - started
+
+
+@pytest.fixture
+def catalog(shop, product):
+    def func(rows):
+        shop_ = shop()
+        products = [product() for _ in range(10)]
+        ProductInfo.objects.bulk_create([
+            ProductInfo(
+                product=products[index % len(products)], shop=shop_, external_id=index, model=f'model/{index}',
+                quantity=index % 20, price=100 + index, price_rrc=150 + index
+            ) for index in range(rows)
+        ])
+        product_infos = list(ProductInfo.objects.filter(shop=shop_).order_by('id'))
+        parameters = baker.make('api.Parameter', _quantity=PARAMETERS)
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info=item, parameter=parameter, value=f'value {item.external_id % 7}')
+            for item in product_infos for parameter in parameters
+        ])
+        refresh_catalog_entries([item.id for item in product_infos])
+        return product_infos
+    return func
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.django_db
+def test_product_serializer_benchmark(catalog, benchmark_result, rows):
+    catalog(rows)
+    product_infos = ProductInfo.objects.order_by('id')
+    catalog_entries = CatalogEntry.objects.order_by('pk')
+    cases = {
+        'product_info': (
+            lambda: ProductInfoSerializer(
+                product_infos.select_related('product__category').prefetch_related('product_parameters__parameter'),
+                many=True
+            ).data,
+            lambda: serialize_product_infos(product_infos),
+        ),
+        'catalog_entry': (
+            lambda: CatalogEntrySerializer(catalog_entries, many=True).data,
+            lambda: serialize_catalog_entries(catalog_entries.values(*CATALOG_ENTRY_VALUES)),
+        ),
+    }
+
+    for name, (serializer, fast) in cases.items():
+        expected, serializer_seconds = measure(serializer)
+        content, fast_seconds = measure(fast)
+        benchmark_result(
+            f'serialize_{name}', rows=rows, parameters=PARAMETERS,
+            serializer_rows_per_second=round(rows / serializer_seconds),
+            fast_rows_per_second=round(rows / fast_seconds),
+            speedup=round(serializer_seconds / fast_seconds, 1)
+        )
+        assert content == expected
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.django_db
+def test_order_serializer_benchmark(catalog, user, benchmark_result, rows):
+    product_infos = catalog(rows)
+    customer = user(is_active=True)
+    Order.objects.bulk_create([Order(user=customer, status='new') for _ in range(rows // ITEMS_PER_ORDER)])
+    orders = list(Order.objects.filter(user=customer).order_by('id'))
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_info=product_infos[index * ITEMS_PER_ORDER + number], quantity=number + 1)
+        for index, order in enumerate(orders) for number in range(ITEMS_PER_ORDER)
+    ])
+    queryset = Order.objects.filter(user=customer).annotate(
+        total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
+    ).distinct().order_by('-dt', '-id')
+
+    expected, serializer_seconds = measure(lambda: OrderSerializer(queryset.prefetch_related(
+        'ordered_items__product_info__product__category',
+        'ordered_items__product_info__product_parameters__parameter'
+    ).select_related('contact'), many=True).data)
+    content, fast_seconds = measure(lambda: serialize_orders(queryset))
+    benchmark_result(
+        'serialize_order', rows=rows, items_per_order=ITEMS_PER_ORDER, parameters=PARAMETERS,
+        serializer_rows_per_second=round(rows / serializer_seconds),
+        fast_rows_per_second=round(rows / fast_seconds),
+        speedup=round(serializer_seconds / fast_seconds, 1)
+    )
+    assert content == expected
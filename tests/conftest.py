@@ -1,14 +1,41 @@
+import io
+import json
 import pytest
+import yaml
+from django.core.cache import caches
 from model_bakery import baker
 from faker import Faker
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
+from api.catalog import refresh_catalog_entries
 from api.models import ConfirmEmailToken
 
 fake = Faker()
 Faker.seed(1)
 
 
+@pytest.fixture(autouse=True)
+def import_jobs_inline(settings):
+    settings.IMPORT_JOB_WORKERS = 0
+
+
+@pytest.fixture(autouse=True)
+def import_upload_dir(settings, tmp_path):
+    settings.IMPORT_UPLOAD_DIR = tmp_path / 'uploads'
+    return settings.IMPORT_UPLOAD_DIR
+
+
+@pytest.fixture(autouse=True)
+def local_cache(settings):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(local_cache):
+    for cache in caches.all():
+        cache.clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -102,7 +129,8 @@ def product_info(product, shop):
             shop_id = shop(user_id=kwargs.pop('partner_id')).id
         else:
             shop_id = shop().id
-        return baker.make(
+        kwargs.setdefault('quantity', fake.random.randint(100, 1000))
+        product_infos = baker.make(
             'api.ProductInfo',
             product_id=product_id,
             shop_id=shop_id,
@@ -110,6 +138,11 @@ def product_info(product, shop):
             make_m2m=True,
             **kwargs
         )
+        if isinstance(product_infos, list):
+            refresh_catalog_entries([item.id for item in product_infos])
+        else:
+            refresh_catalog_entries([product_infos.id])
+        return product_infos
     return func
 
 
@@ -141,3 +174,68 @@ def order_items(order, product_info):
             make_m2m=True,
             **kwargs)
     return func
+
+
+@pytest.fixture
+def price_list():
+    def func(goods=10, parameters=3, shop='Test Shop'):
+        categories = [{'id': 1000 + index, 'name': f'Category {index}'} for index in range(3)]
+        return {
+            'shop': shop,
+            'categories': categories,
+            'goods': [
+                {
+                    'id': 10000 + index,
+                    'category': categories[index % len(categories)]['id'],
+                    'model': f'model/{index}',
+                    'name': f'Product {index}',
+                    'price': 100 + index,
+                    'price_rrc': 150 + index,
+                    'quantity': index % 20,
+                    'parameters': {f'Parameter {number}': f'value {index % 7}' for number in range(parameters)},
+                } for index in range(goods)
+            ],
+        }
+    return func
+
+
+class FeedResponse:
+    def __init__(self, content, headers=None, status_code=200):
+        self.raw = io.BytesIO(content)
+        self.headers = headers or {}
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.raw.close()
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def feed_server(monkeypatch):
+    def func(data, content_type='application/x-yaml', etag=None):
+        if content_type == 'application/x-ndjson':
+            lines = [{'shop': data['shop']}]
+            lines += [{'categories': category} for category in data['categories']]
+            lines += [{'goods': item} for item in data['goods']]
+            content = '\n'.join(json.dumps(line, ensure_ascii=False) for line in lines).encode()
+        elif content_type == 'application/json':
+            content = json.dumps(data, ensure_ascii=False).encode()
+        else:
+            content = yaml.dump(data, allow_unicode=True, sort_keys=False).encode()
+        response_headers = {'Content-Type': content_type}
+        if etag:
+            response_headers['ETag'] = etag
+
+        def get(url, headers=None, **kwargs):
+            if etag and (headers or {}).get('If-None-Match') == etag:
+                return FeedResponse(b'', status_code=304)
+            return FeedResponse(content, response_headers)
+
+        monkeypatch.setattr('api.jobs.requests.get', get)
+        return content
+    return func